@@ -0,0 +1,66 @@
+from logging.config import fileConfig
+
+from sqlalchemy import engine_from_config, pool
+
+from alembic import context
+from app import models  # noqa: F401 Registers the tables on the metadata
+from app.config import settings
+from app.database import Base
+
+config = context.config
+
+# Configured from alembic.ini on the command line, left alone when the
+# migrations are run from code
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+# The app's database unless the caller passed another URL
+if not config.get_main_option("sqlalchemy.url"):
+    config.set_main_option("sqlalchemy.url", settings.DATABASE_URL.replace("%", "%%"))
+
+target_metadata = Base.metadata
+
+# Full-text search structures, created with raw DDL by the migrations and
+# unknown to the models. Autogenerate must not drop them.
+UNMANAGED_PREFIXES = ("products_fts", "ix_products_search")
+
+
+def include_name(name, type_, parent_names) -> bool:
+    return not (name or "").startswith(UNMANAGED_PREFIXES)
+
+
+def run_migrations_offline() -> None:
+    """Emit the migration SQL as a script instead of running it"""
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url"),
+        target_metadata=target_metadata,
+        include_name=include_name,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section, {}),
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+    with connectable.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_name=include_name,
+            # SQLite cannot alter most of a table in place
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,48 @@
+"""inventory reservations
+
+Revision ID: 5c0e4a71d2b9
+Revises: 9368a3dae768
+Create Date: 2026-10-18 19:02:11.418259
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5c0e4a71d2b9"
+down_revision: Union[str, None] = "9368a3dae768"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "inventory_reservations",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("order_id", sa.Integer(), nullable=False),
+        sa.Column("product_id", sa.Integer(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["order_id"], ["orders.id"]),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_inventory_reservations_product_id"),
+        "inventory_reservations",
+        ["product_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        op.f("ix_inventory_reservations_product_id"),
+        table_name="inventory_reservations",
+    )
+    op.drop_table("inventory_reservations")
@@ -0,0 +1,30 @@
+"""order claims
+
+Revision ID: 7a2d5f0c81e4
+Revises: e3f1a9c47b62
+Create Date: 2026-10-18 20:12:48.530917
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7a2d5f0c81e4"
+down_revision: Union[str, None] = "e3f1a9c47b62"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("orders", sa.Column("claimed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.drop_column("claimed_at")
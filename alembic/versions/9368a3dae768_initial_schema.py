@@ -0,0 +1,129 @@
+"""initial schema
+
+Revision ID: 9368a3dae768
+Revises: 1f0c6d2b8e45
+Create Date: 2026-10-18 18:30:58.700402
+
+Brings the pre-migration schema up to the first one managed by Alembic.
+Databases created by a release with ``create_all`` at startup may already
+have some of these tables and indexes, only the missing ones are added.
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9368a3dae768"
+down_revision: Union[str, None] = "1f0c6d2b8e45"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must stay identical to models.PRODUCT_SEARCH_DOCUMENT for queries to use it
+PRODUCT_SEARCH_DOCUMENT = (
+    "to_tsvector('english'::regconfig, "
+    "coalesce(name, '') || ' ' || coalesce(description, ''))"
+)
+
+PRODUCTS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE products_fts USING fts5(name, description, "
+    "content='products', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER products_fts_update AFTER UPDATE OF name, description "
+    "ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+)
+
+
+def _index_names(inspector, table: str) -> set[str]:
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def _set_order_items_primary_key(inspector, columns: list[str]) -> None:
+    name = inspector.get_pk_constraint("order_items")["name"]
+    op.drop_constraint(name, "order_items", type_="primary")
+    op.create_primary_key("order_items_pkey", "order_items", columns)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+
+    if "idempotency_keys" not in tables:
+        op.create_table(
+            "idempotency_keys",
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("key", sa.String(length=255), nullable=False),
+            sa.Column("fingerprint", sa.String(length=64), nullable=False),
+            sa.Column("status_code", sa.Integer(), nullable=True),
+            sa.Column("response_body", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("expires_at", sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("user_id", "key"),
+        )
+        op.create_index(
+            op.f("ix_idempotency_keys_expires_at"),
+            "idempotency_keys",
+            ["expires_at"],
+            unique=False,
+        )
+
+    if "ix_orders_user_id_id" not in _index_names(inspector, "orders"):
+        op.create_index(
+            "ix_orders_user_id_id", "orders", ["user_id", "id"], unique=False
+        )
+
+    # The first releases keyed order items by (id, order_id, product_id),
+    # except on SQLite, see the previous revision
+    primary_key = inspector.get_pk_constraint("order_items")["constrained_columns"]
+    if primary_key != ["id"]:
+        _set_order_items_primary_key(inspector, ["id"])
+    if "ix_order_items_order_id" not in _index_names(inspector, "order_items"):
+        op.create_index(
+            op.f("ix_order_items_order_id"), "order_items", ["order_id"], unique=False
+        )
+
+    dialect = bind.dialect.name
+    if dialect == "postgresql":
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_products_search ON products "
+            f"USING gin (({PRODUCT_SEARCH_DOCUMENT}))"
+        )
+    elif dialect == "sqlite" and "products_fts" not in tables:
+        for statement in PRODUCTS_FTS_DDL:
+            op.execute(statement)
+        # Index the products that already exist
+        op.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_products_search")
+    elif dialect == "sqlite":
+        for trigger in ("insert", "delete", "update"):
+            op.execute(f"DROP TRIGGER IF EXISTS products_fts_{trigger}")
+        op.execute("DROP TABLE IF EXISTS products_fts")
+
+    op.drop_index(op.f("ix_order_items_order_id"), table_name="order_items")
+    if dialect != "sqlite":
+        _set_order_items_primary_key(
+            sa.inspect(op.get_bind()), ["id", "order_id", "product_id"]
+        )
+    op.drop_index("ix_orders_user_id_id", table_name="orders")
+    op.drop_index(op.f("ix_idempotency_keys_expires_at"), table_name="idempotency_keys")
+    op.drop_table("idempotency_keys")
@@ -0,0 +1,93 @@
+"""fixed point money
+
+Revision ID: e3f1a9c47b62
+Revises: 5c0e4a71d2b9
+Create Date: 2026-10-18 19:41:37.905214
+
+Prices and totals move from Float to Numeric(12, 2), rounded to cents, and
+order items get the unit price they were bought at. Items of existing
+orders are backfilled with the product's current price, the best guess
+left.
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e3f1a9c47b62"
+down_revision: Union[str, None] = "5c0e4a71d2b9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONEY = sa.Numeric(12, 2)
+
+# SQLite rebuilds the products table to change a column type, which drops
+# the triggers keeping products_fts in sync
+PRODUCTS_FTS_TRIGGERS = (
+    "CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER products_fts_update AFTER UPDATE OF name, description "
+    "ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+)
+
+
+def _alter_products_price(type_, existing_type, using: str) -> None:
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.alter_column(
+            "price",
+            existing_type=existing_type,
+            type_=type_,
+            existing_nullable=True,
+            postgresql_using=using,
+        )
+    if op.get_bind().dialect.name == "sqlite":
+        for statement in PRODUCTS_FTS_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _alter_products_price(MONEY, sa.Float(), "round(price::numeric, 2)")
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.alter_column(
+            "total_price",
+            existing_type=sa.Float(),
+            type_=MONEY,
+            existing_nullable=True,
+            postgresql_using="round(total_price::numeric, 2)",
+        )
+
+    op.add_column("order_items", sa.Column("unit_price", MONEY, nullable=True))
+    op.execute(
+        "UPDATE order_items SET unit_price = coalesce(("
+        "SELECT price FROM products WHERE products.id = order_items.product_id"
+        "), 0)"
+    )
+    with op.batch_alter_table("order_items") as batch_op:
+        batch_op.alter_column("unit_price", existing_type=MONEY, nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("order_items") as batch_op:
+        batch_op.drop_column("unit_price")
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.alter_column(
+            "total_price",
+            existing_type=MONEY,
+            type_=sa.Float(),
+            existing_nullable=True,
+            postgresql_using="total_price::double precision",
+        )
+    _alter_products_price(sa.Float(), MONEY, "price::double precision")
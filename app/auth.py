@@ -1,19 +1,28 @@
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import database, models
+from app.cache import TTLCache
+from app.config import settings
+from app.hashing import HashingOverloaded, hashing_executor
+from app.timing import timed
 
 SECRET_KEY = "temp"  # Change this in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
@@ -27,41 +36,233 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_password(plain_password, hashed_password):
-    """Verify password hash"""
+def _verify(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    """Hash password"""
+def _hash(password):
     return pwd_context.hash(password)
 
 
-def authenticate_user(db: Session, email: str, password: str):
-    """Authenticate user credentials"""
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+def _hashing_overloaded():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication is busy, retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
+def verify_password(plain_password, hashed_password):
+    """Verify password hash on the hashing executor"""
+    try:
+        with timed("auth"):
+            return hashing_executor.run(_verify, plain_password, hashed_password)
+    except HashingOverloaded:
+        raise _hashing_overloaded()
+
+
+def get_password_hash(password):
+    """Hash password on the hashing executor"""
+    try:
+        with timed("auth"):
+            return hashing_executor.run(_hash, password)
+    except HashingOverloaded:
+        raise _hashing_overloaded()
+
+
+async def verify_password_async(plain_password, hashed_password):
+    """Verify password hash without blocking the event loop"""
+    try:
+        with timed("auth"):
+            return await hashing_executor.run_async(
+                _verify, plain_password, hashed_password
+            )
+    except HashingOverloaded:
+        raise _hashing_overloaded()
+
+
+async def get_password_hash_async(password):
+    """Hash password without blocking the event loop"""
+    try:
+        with timed("auth"):
+            return await hashing_executor.run_async(_hash, password)
+    except HashingOverloaded:
+        raise _hashing_overloaded()
+
+
+def get_user_by_email(db: Session, email: str):
+    """Look up a user by email"""
+    return db.query(models.User).filter(models.User.email == email).first()
+
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    """Authenticate user credentials on an async session"""
+    user = await db.scalar(select(models.User).where(models.User.email == email))
+    if not user or not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
-):
-    """Retrieve current logged-in user"""
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_token(token: str) -> tuple[int, Optional[float]]:
+    """
+    Extract the user id and expiry time from a JWT, raising 401 if the token
+    is invalid
+    """
+    credentials_exception = _credentials_exception()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
+        user_id = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+        return int(user_id), payload.get("exp")
+    except (JWTError, ValueError):
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
+
+
+def decode_request_token(request: Request, token: str) -> tuple[int, Optional[float]]:
+    """
+    ``decode_token`` once per request, the read session and the principal
+    dependencies both need the claims
+    """
+    decoded = getattr(request.state, "decoded_token", None)
+    if decoded is None or decoded[0] != token:
+        decoded = (token, decode_token(token))
+        request.state.decoded_token = decoded
+    return decoded[1]
+
+
+# Principals of recently seen tokens, so authenticated requests can skip the
+# user lookup. Entries are dropped by invalidate_principal, which runs after
+# every commit that changed or deleted a user through the ORM.
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+
+
+def invalidate_principal(user_id: int) -> None:
+    """Drop every cached principal of a user, e.g. after a password change"""
+    principal_cache.delete_where(lambda entry: entry[0] == user_id)
+
+
+def clear_principal_cache() -> None:
+    principal_cache.clear()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = {
+        obj.id
+        for obj in (*session.dirty, *session.deleted)
+        if isinstance(obj, models.User)
+    }
+    if changed:
+        session.info.setdefault("changed_users", set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_users", ()):
+        invalidate_principal(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changed_users(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("changed_users", None)
+
+
+def _cached_principal(token: str) -> Optional[models.User]:
+    entry = principal_cache.get(token)
+    if entry is None:
+        return None
+    user_id, email = entry
+    return models.User(id=user_id, email=email)
+
+
+def _cache_principal(token: str, user: models.User, expires_at: Optional[float]):
+    ttl = settings.PRINCIPAL_CACHE_TTL
+    if expires_at is not None:
+        # Never serve a principal past the expiry of its token
+        ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+    principal_cache.set(token, (user.id, user.email), ttl=ttl)
+
+
+def get_current_user(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Retrieve current logged-in user.
+
+    Principals are served from ``principal_cache`` when possible and are then
+    detached ``User`` instances carrying only ``id`` and ``email``.
+    """
+    with timed("auth"):
+        user_id, expires_at = decode_request_token(request, token)
+        user = _cached_principal(token)
+        if user is not None:
+            return user
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if user is None:
+            raise _credentials_exception()
+        _cache_principal(token, user, expires_at)
+        return user
+
+
+async def get_current_user_async(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """Retrieve current logged-in user on an async session"""
+    with timed("auth"):
+        user_id, expires_at = decode_request_token(request, token)
+        user = _cached_principal(token)
+        if user is not None:
+            return user
+        user = await db.get(models.User, user_id)
+        if user is None:
+            raise _credentials_exception()
+        _cache_principal(token, user, expires_at)
+        return user
+
+
+def get_current_principal(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Principal for read-only endpoints.
+
+    With ``TRUST_TOKEN_CLAIMS`` the signed claims are trusted outright and no
+    lookup happens at all, so a deleted user keeps read access until the
+    token expires. Otherwise this is ``get_current_user``.
+    """
+    if settings.TRUST_TOKEN_CLAIMS:
+        with timed("auth"):
+            return models.User(id=decode_request_token(request, token)[0])
+    return get_current_user(request, token, db)
+
+
+async def get_current_principal_async(
+    request: Request,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """Async counterpart of ``get_current_principal``"""
+    if settings.TRUST_TOKEN_CLAIMS:
+        with timed("auth"):
+            return models.User(id=decode_request_token(request, token)[0])
+    return await get_current_user_async(request, token, db)
@@ -0,0 +1,162 @@
+import csv
+import json
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from pydantic import ValidationError
+
+from app import schemas
+from app.config import settings
+from app.logger import logger
+
+# Lines longer than this are rejected without being buffered any further
+MAX_LINE_BYTES = 1024 * 1024
+
+FORMATS = ("ndjson", "csv")
+
+
+def detect_format(content_type: Optional[str]) -> str:
+    """Pick the import format from the request's content type"""
+    if content_type and "csv" in content_type:
+        return "csv"
+    return "ndjson"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, bytes]]:
+    """
+    Split a streamed body into numbered lines.
+
+    Only the current partial line is buffered. A line longer than
+    ``MAX_LINE_BYTES`` is yielded as ``None`` and skipped up to its end.
+    """
+    buffer = b""
+    line_number = 0
+    overlong = False
+    async for chunk in chunks:
+        # One split per chunk, the trailing partial line is carried over
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, None if overlong else line.rstrip(b"\r")
+            overlong = False
+        if len(buffer) > MAX_LINE_BYTES:
+            overlong, buffer = True, b""
+    if buffer or overlong:
+        yield line_number + 1, None if overlong else buffer.rstrip(b"\r")
+
+
+async def iter_records(
+    chunks: AsyncIterator[bytes], fmt: str
+) -> AsyncIterator[tuple[int, object]]:
+    """
+    Yield ``(line_number, record)`` for every non-blank line.
+
+    Records are dicts, or an error message when the line cannot be parsed.
+    For CSV the first line is the header; quoted fields cannot span lines.
+    """
+    header = None
+    async for line_number, raw in iter_lines(chunks):
+        if raw is None:
+            yield line_number, f"Line exceeds {MAX_LINE_BYTES} bytes"
+            continue
+        if not raw.strip():
+            continue
+        try:
+            line = raw.decode("utf-8-sig" if line_number == 1 else "utf-8")
+        except UnicodeDecodeError:
+            yield line_number, "Line is not valid UTF-8"
+            continue
+
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            if len(values) != len(header):
+                yield line_number, f"Expected {len(header)} fields, got {len(values)}"
+                continue
+            yield line_number, dict(zip(header, values))
+        else:
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, "Expected a JSON object"
+                continue
+            yield line_number, record
+
+
+class ImportReport:
+    """Outcome of a bulk import, keeping at most ``max_errors`` row errors"""
+
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.inserted = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def add_error(self, line: int, errors: list) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
+
+    def to_dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def import_products(
+    chunks: AsyncIterator[bytes],
+    fmt: str,
+    insert_chunk: Callable[[list[dict]], Awaitable[None]],
+    chunk_size: Optional[int] = None,
+) -> ImportReport:
+    """
+    Validate streamed product rows and insert them in chunks.
+
+    Rows are checked against ``schemas.ProductCreate`` as they arrive and
+    handed to ``insert_chunk`` every ``chunk_size`` valid rows, so memory use
+    is bounded by the chunk size whatever the size of the upload. A chunk
+    the database rejects is reported against each of its lines.
+    """
+    chunk_size = chunk_size or settings.BULK_IMPORT_CHUNK_SIZE
+    report = ImportReport(settings.BULK_IMPORT_MAX_ERRORS)
+    rows: list[dict] = []
+    lines: list[int] = []
+
+    async def flush():
+        try:
+            await insert_chunk(rows)
+        except Exception as e:
+            logger.error("Bulk import chunk failed: %s", e)
+            for line in lines:
+                report.add_error(line, [{"msg": "Database rejected the chunk"}])
+        else:
+            report.inserted += len(rows)
+        rows.clear()
+        lines.clear()
+
+    async for line_number, record in iter_records(chunks, fmt):
+        if isinstance(record, str):
+            report.add_error(line_number, [{"msg": record}])
+            continue
+        try:
+            product = schemas.ProductCreate.model_validate(record)
+        except ValidationError as e:
+            report.add_error(
+                line_number, e.errors(include_url=False, include_context=False)
+            )
+            continue
+        rows.append(product.model_dump())
+        lines.append(line_number)
+        if len(rows) >= chunk_size:
+            await flush()
+
+    if rows:
+        await flush()
+    return report
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Optional
+
+from fastapi import Request
+
+from app import schemas
+from app.config import settings
+from app.serialization import dump_rows
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate) -> int:
+        """Delete every entry whose value satisfies ``predicate``"""
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    """
+    Cache backed by a Redis-compatible client.
+
+    Only ``get``, ``set(..., ex=...)`` and ``delete`` are used, so any client
+    exposing those (including an in-memory fake in tests) can stand in.
+    Values are stored as JSON under ``prefix``.
+    """
+
+    def __init__(self, client, ttl: float = 60.0, prefix: str = "ecommerce:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        # Milliseconds, whole seconds would round sub-second TTLs down to 0
+        self.client.set(
+            self.prefix + key,
+            json.dumps(value),
+            px=max(int(ttl * 1000), 1) if ttl > 0 else None,
+        )
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+
+def create_backend():
+    """Build the cache backend selected by ``settings.CACHE_BACKEND``"""
+    if settings.CACHE_BACKEND == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+        return RedisCache(redis.Redis.from_url(settings.REDIS_URL), settings.CACHE_TTL)
+    return TTLCache(maxsize=settings.CACHE_MAXSIZE, ttl=settings.CACHE_TTL)
+
+
+@dataclass
+class CachedPage:
+    """
+    A listing page kept as its encoded JSON body, so a hit is served without
+    serializing anything. ``count`` and ``last_id`` are what pagination needs
+    from the items.
+    """
+
+    body: str
+    count: int
+    last_id: Optional[int]
+    etag: str
+    last_modified: float
+
+    def headers(self) -> dict:
+        return {
+            "ETag": self.etag,
+            "Last-Modified": formatdate(self.last_modified, usegmt=True),
+            "Cache-Control": "public, no-cache",
+        }
+
+    def not_modified(self, request: Request) -> bool:
+        """Whether the client's conditional headers match this page"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = {tag.strip() for tag in if_none_match.split(",")}
+            return "*" in tags or self.etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            # HTTP dates have a one second resolution
+            return int(self.last_modified) <= since
+        return False
+
+
+class ProductCatalogCache:
+    """
+    Read cache for product listing pages.
+
+    Every page key embeds the catalog version, so ``invalidate`` drops all
+    cached pages at once by moving to a new version. The version doubles as
+    the ``Last-Modified`` time of the catalog.
+    """
+
+    VERSION_KEY = "products:version"
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _version(self) -> float:
+        version = self.backend.get(self.VERSION_KEY)
+        if version is None:
+            version = time.time()
+            self.backend.set(self.VERSION_KEY, version, ttl=0)
+        return version
+
+    def page_key(self, **params) -> str:
+        query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+        return f"products:{self._version()}:{query}"
+
+    def get(self, key: str) -> Optional[CachedPage]:
+        page = self.backend.get(key)
+        return None if page is None else CachedPage(**page)
+
+    def store(self, key: str, products: list) -> CachedPage:
+        body = dump_rows(schemas.Product, products)
+        page = CachedPage(
+            body=body.decode(),
+            count=len(products),
+            last_id=products[-1].id if products else None,
+            etag=f'"{hashlib.sha1(body).hexdigest()}"',
+            # Keys are "products:<version>:<query>"
+            last_modified=float(key.split(":", 2)[1]),
+        )
+        self.backend.set(key, page.__dict__)
+        return page
+
+    def invalidate(self) -> None:
+        self.backend.set(self.VERSION_KEY, time.time(), ttl=0)
+
+
+product_cache = ProductCatalogCache(create_backend())
@@ -1,53 +1,375 @@
-from sqlalchemy.orm import Session
+import csv
+import io
+import re
+from decimal import Decimal
+from typing import Optional
 
-from app.models import Order, OrderItem, Product
+from sqlalchemy import (
+    case,
+    column,
+    func,
+    insert,
+    literal_column,
+    or_,
+    select,
+    table,
+    update,
+)
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+from starlette.concurrency import run_in_threadpool
+
+from app import inventory
+from app.cache import product_cache
+from app.config import settings
+from app.models import (
+    PRODUCT_SEARCH_DOCUMENT,
+    InventoryReservation,
+    Order,
+    OrderItem,
+    Product,
+)
 from app.schemas import OrderCreate, ProductCreate
 
 
 # Create Product
 def create_product(db: Session, product: ProductCreate):
-    db_product = Product(**product.dict())
+    db_product = Product(**product.model_dump())
     db.add(db_product)
     db.commit()
+    product_cache.invalidate()
     db.refresh(db_product)
     return db_product
 
 
+# Bulk create Products
+def bulk_create_products(db: Session, rows: list[dict], user_id: int):
+    """
+    Insert a chunk of validated product rows owned by ``user_id`` and commit.
+
+    On PostgreSQL with psycopg2 the rows are streamed with ``COPY``, elsewhere
+    they go out as a single multi-row ``INSERT``. The session is rolled back
+    if the chunk is rejected.
+    """
+    rows = [{**row, "user_id": user_id} for row in rows]
+    try:
+        if settings.BULK_IMPORT_USE_COPY and db.get_bind().dialect.driver == "psycopg2":
+            _copy_products(db, rows)
+        else:
+            db.execute(insert(Product), rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _copy_products(db: Session, rows: list[dict]):
+    columns = ("name", "description", "price", "stock", "user_id")
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([row[c] for c in columns] for row in rows)
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY products ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
 # Get all Products
-def get_products(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(Product).offset(skip).limit(limit).all()
+def get_products(
+    db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None
+):
+    """
+    List products ordered by id.
+
+    With ``after_id`` the page is found by seeking past that id on the
+    primary key, which costs the same at any depth; otherwise ``skip`` rows
+    are skipped with OFFSET.
+    """
+    query = db.query(Product).order_by(Product.id)
+    if after_id is not None:
+        query = query.filter(Product.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+# Search Products
+def search_products(
+    db: Session,
+    q: str,
+    min_price: Optional[Decimal] = None,
+    max_price: Optional[Decimal] = None,
+    in_stock: bool = False,
+    skip: int = 0,
+    limit: int = 20,
+):
+    """
+    Full-text search over product names and descriptions, best match first.
+
+    PostgreSQL matches ``q`` as a web search query (quoted phrases, ``or``,
+    ``-word``) against the GIN indexed ``PRODUCT_SEARCH_DOCUMENT`` and ranks
+    by ``ts_rank_cd``. SQLite matches every word of ``q`` through the
+    ``products_fts`` FTS5 table and ranks by bm25. Other databases fall back
+    to an unranked substring match.
+    """
+    dialect = db.get_bind().dialect.name
+    stmt = select(Product)
+    if dialect == "postgresql":
+        document = literal_column(PRODUCT_SEARCH_DOCUMENT)
+        query = func.websearch_to_tsquery(literal_column("'english'::regconfig"), q)
+        stmt = stmt.where(document.op("@@")(query)).order_by(
+            func.ts_rank_cd(document, query).desc()
+        )
+    elif dialect == "sqlite":
+        words = re.findall(r"\w+", q)
+        if not words:
+            return []
+        # Quoted words are taken literally instead of as FTS5 query syntax
+        match = " ".join(f'"{word}"' for word in words)
+        fts = table("products_fts", column("rowid"), column("rank"))
+        stmt = (
+            stmt.join(fts, fts.c.rowid == Product.id)
+            .where(literal_column("products_fts").op("MATCH")(match))
+            .order_by(fts.c.rank)
+        )
+    else:
+        pattern = f"%{q}%"
+        stmt = stmt.where(
+            or_(Product.name.ilike(pattern), Product.description.ilike(pattern))
+        )
+
+    if min_price is not None:
+        stmt = stmt.where(Product.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(Product.price <= max_price)
+    if in_stock:
+        stmt = stmt.where(Product.stock > 0)
+    stmt = stmt.order_by(Product.id).offset(skip).limit(limit)
+    return db.scalars(stmt).all()
+
+
+# Line items with their products, loaded up front in two statements: one
+# SELECT ... WHERE order_id IN (...) joined to products, whatever the number
+# of orders and items
+_ORDER_ITEMS = selectinload(Order.order_items).joinedload(OrderItem.product)
+
+
+# Get a user's Order
+def get_order(db: Session, order_id: int, user_id: int) -> Optional[Order]:
+    """A user's order with its line items and products, None if not found."""
+    return (
+        db.query(Order)
+        .filter(Order.id == order_id, Order.user_id == user_id)
+        .options(_ORDER_ITEMS)
+        .first()
+    )
+
+
+# Get a user's Orders
+def get_orders(
+    db: Session,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
+    with_items: bool = False,
+):
+    """
+    List a user's orders ordered by id, see ``get_products`` for paging.
+    With ``with_items`` line items and products are loaded as well, at a
+    constant number of statements per page.
+    """
+    query = db.query(Order).filter(Order.user_id == user_id).order_by(Order.id)
+    if with_items:
+        query = query.options(_ORDER_ITEMS)
+    if after_id is not None:
+        query = query.filter(Order.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+class InsufficientStockError(ValueError):
+    """Raised when one or more order lines cannot be reserved."""
+
+    def __init__(self, lines: list[dict]):
+        self.lines = lines
+        product_ids = ", ".join(str(line["product_id"]) for line in lines)
+        super().__init__(f"Not enough stock for product {product_ids}")
+
+
+# Reserve Stock
+def reserve_stock(
+    db: Session, quantities: dict[int, int]
+) -> dict[int, tuple[Decimal, Decimal]]:
+    """
+    Atomically deduct stock for every product in ``quantities``.
+
+    A single conditional ``UPDATE ... WHERE stock >= :quantity RETURNING``
+    reserves all lines at once, so concurrent checkouts can never oversell
+    and no row lock is held between reading and writing stock. Returns the
+    unit price and line total of each reserved product, both computed by
+    the database in that statement. If any line could not be reserved,
+    ``InsufficientStockError`` is raised and the caller must roll back the
+    transaction to release the lines that were reserved.
+    """
+    requested = case(quantities, value=Product.id)
+    amount = (Product.price * requested).label("amount")
+    stmt = (
+        update(Product)
+        .where(Product.id.in_(quantities), Product.stock >= requested)
+        .values(stock=Product.stock - requested)
+        .returning(Product.id, Product.price, amount)
+        .execution_options(synchronize_session=False)
+    )
+    lines = {row.id: (row.price, row.amount) for row in db.execute(stmt)}
+
+    insufficient = [
+        {"product_id": product_id, "requested": quantity}
+        for product_id, quantity in quantities.items()
+        if product_id not in lines
+    ]
+    if insufficient:
+        raise InsufficientStockError(insufficient)
+    return lines
+
+
+def run_blocking(fn, *args):
+    """
+    Call ``fn``, which blocks on I/O outside the session, e.g. a method of
+    the inventory engine. Under ``AsyncSession.run_sync`` this code runs on
+    the event loop, so the call goes to a worker thread instead and the loop
+    keeps serving other requests meanwhile.
+    """
+    if in_greenlet():
+        return await_only(run_in_threadpool(fn, *args))
+    return fn(*args)
+
+
+def reserve_inventory(
+    db: Session, engine: inventory.InventoryEngine, quantities: dict[int, int]
+) -> dict[int, tuple[Decimal, Decimal]]:
+    """
+    ``reserve_stock`` against the counters of the inventory engine, which
+    leaves the product rows alone. The caller must ``release`` the
+    quantities again if the checkout does not commit.
+    """
+    amount = (Product.price * case(quantities, value=Product.id)).label("amount")
+    stmt = select(Product.id, Product.price, amount).where(Product.id.in_(quantities))
+    lines = {row.id: (row.price, row.amount) for row in db.execute(stmt)}
+    insufficient = [pid for pid in quantities if pid not in lines]
+    if not insufficient:
+        missing = run_blocking(engine.unloaded, list(quantities))
+        if missing:
+            # Read on the checkout's own connection, loading on a second one
+            # would hold two pooled connections per checkout
+            rows = db.execute(engine.stock_to_load(missing)).all()
+            run_blocking(engine.fill, rows)
+        insufficient = run_blocking(engine.reserve, quantities)
+    if insufficient:
+        raise InsufficientStockError(
+            [
+                {"product_id": product_id, "requested": quantities[product_id]}
+                for product_id in insufficient
+            ]
+        )
+    return lines
+
+
+# Release Stock
+def release_order_stock(db: Session, order_id: int) -> dict[int, int]:
+    """
+    Put the stock reserved by an order back, without committing. Used when
+    an order fails after checkout. Returns the released quantities, which
+    the caller gives back to the inventory engine, if any, after commit.
+    """
+    items = db.execute(
+        select(OrderItem.product_id, OrderItem.quantity).where(
+            OrderItem.order_id == order_id
+        )
+    )
+    quantities = {product_id: quantity for product_id, quantity in items}
+    if not quantities:
+        return quantities
+    db.execute(
+        update(Product)
+        .where(Product.id.in_(quantities))
+        .values(stock=Product.stock + case(quantities, value=Product.id))
+        .execution_options(synchronize_session=False)
+    )
+    return quantities
 
 
 # Create Order
-def create_order(db: Session, order: OrderCreate):
-    total_price = 0.0
-    order_items = []
+def create_order(db: Session, order: OrderCreate, user_id: int, before_commit=None):
+    """
+    Place an order in a single transaction.
+
+    Stock for all lines is reserved with one conditional update (see
+    ``reserve_stock``), the order row is flushed for its id and the items go
+    out as one executemany, so the number of statements does not grow with
+    the size of the cart and the whole checkout commits once. With the
+    inventory engine enabled the stock is taken from its counters instead,
+    and the order's reservations are logged for reconciliation.
+
+    Prices and line totals come from the reserving statement, every item
+    records its unit price and the order total is their exact sum.
 
+    ``before_commit(db, order)`` is called once the order is flushed, to add
+    writes that must commit together with it.
+    """
+    quantities = {}
     for item in order.products:
         if item.quantity <= 0:
             raise ValueError(
                 f"Quantity for product {item.product_id} must be greater than zero."
             )
+        # Repeated lines for the same product are merged into one order item
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
 
-        product = db.query(Product).filter(Product.id == item.product_id).first()
-        if product and product.stock >= item.quantity:
-            total_price += product.price * item.quantity
-            product.stock -= item.quantity
-            order_item = OrderItem(product_id=item.product_id, quantity=item.quantity)
-            order_items.append(order_item)
-        else:
-            raise ValueError(f"Not enough stock for product {item.product_id}")
-
-    db_order = Order(total_price=total_price)
-    db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-
-    for order_item in order_items:
-        order_item.order_id = db_order.id  # Make sure to set the order_id
-        db.add(order_item)
+    engine = inventory.inventory_engine
+    if not quantities:
+        reserved = {}
+    elif engine is not None:
+        reserved = reserve_inventory(db, engine, quantities)
+    else:
+        reserved = reserve_stock(db, quantities)
+    total_price = sum((amount for _, amount in reserved.values()), Decimal(0))
 
-    db.commit()
+    try:
+        db_order = Order(user_id=user_id, total_price=total_price, status="pending")
+        db.add(db_order)
+        db.flush()
+        if quantities:
+            lines = [
+                {"order_id": db_order.id, "product_id": pid, "quantity": quantity}
+                for pid, quantity in quantities.items()
+            ]
+            db.execute(
+                insert(OrderItem),
+                [
+                    {**line, "unit_price": reserved[line["product_id"]][0]}
+                    for line in lines
+                ],
+            )
+            if engine is not None:
+                db.execute(insert(InventoryReservation), lines)
+        if before_commit is not None:
+            before_commit(db, db_order)
+        db.commit()
+    except BaseException:
+        if engine is not None:
+            run_blocking(engine.release, quantities)
+        raise
+    if engine is None:
+        # Stock levels changed, cached catalog pages are stale. The engine
+        # invalidates them when it reconciles instead
+        run_blocking(product_cache.invalidate)
     db.refresh(db_order)
 
     return db_order
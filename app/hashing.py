@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.config import settings
+
+
+class HashingOverloaded(Exception):
+    """Raised when the hashing executor has no free slot for new work."""
+
+
+class HashingExecutor:
+    """
+    Bounded executor for password hashing.
+
+    bcrypt releases the GIL, so a small thread pool runs hashes in parallel
+    without touching the request threadpool or the event loop; a process
+    pool can be used instead. At most ``workers + queue_depth`` jobs are
+    accepted at a time and further submissions fail immediately with
+    ``HashingOverloaded`` rather than queueing without limit.
+    """
+
+    def __init__(self, workers: int, queue_depth: int, kind: str = "thread"):
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="hashing"
+            )
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    def submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        """Run ``fn`` on the executor and wait for the result."""
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn, *args):
+        """Run ``fn`` on the executor without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+hashing_executor = HashingExecutor(
+    workers=settings.HASH_WORKERS,
+    queue_depth=settings.HASH_QUEUE_DEPTH,
+    kind=settings.HASH_EXECUTOR,
+)
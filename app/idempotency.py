@@ -0,0 +1,367 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.logger import logger
+from app.models import IdempotencyKey
+from app.serialization import RawJSONResponse
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def fingerprint(payload: dict) -> str:
+    """Hash of a request body, independent of key order"""
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _key_reused():
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"{IDEMPOTENCY_KEY_HEADER} was already used for a different request",
+    )
+
+
+def _still_in_flight():
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"A request with this {IDEMPOTENCY_KEY_HEADER} is still in progress",
+        headers={"Retry-After": "1"},
+    )
+
+
+def _is_stale(record: IdempotencyKey, now: datetime) -> bool:
+    if record.expires_at <= now:
+        return True
+    lock_timeout = timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    return record.status_code is None and record.created_at + lock_timeout <= now
+
+
+def claim(
+    db: Session, user_id: int, key: str, request_hash: str
+) -> tuple[Optional[datetime], Optional[IdempotencyKey]]:
+    """
+    Record ``key`` as in flight for this request.
+
+    Returns the time of the claim and ``None`` when the caller now owns the
+    key and must run the request, otherwise ``None`` and the stored record,
+    whose ``status_code`` is still empty while the first request is in
+    flight. The claim is committed right away, so concurrent requests see
+    it; the primary key makes sure only one of them wins. Expired keys and
+    in-flight claims older than ``IDEMPOTENCY_LOCK_TIMEOUT`` are taken over.
+    Raises 422 if the key was used for a different request body.
+    """
+    retried = False
+    while True:
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_TTL)
+        try:
+            db.execute(
+                insert(IdempotencyKey).values(
+                    user_id=user_id,
+                    key=key,
+                    fingerprint=request_hash,
+                    created_at=now,
+                    expires_at=expires_at,
+                )
+            )
+            db.commit()
+            return now, None
+        except IntegrityError as e:
+            db.rollback()
+            error = e
+
+        record = db.get(IdempotencyKey, (user_id, key), populate_existing=True)
+        if record is None:
+            # Released by a failed attempt in the meantime, or the insert
+            # broke another constraint, e.g. the user is gone. That one
+            # would fail again, so only try once more
+            if retried:
+                raise error
+            retried = True
+            continue
+        if not _is_stale(record, now):
+            if record.fingerprint != request_hash:
+                raise _key_reused()
+            return None, record
+
+        # Take the stale key over, unless another request just did or the
+        # first attempt completed meanwhile
+        result = db.execute(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.created_at == record.created_at,
+                or_(
+                    IdempotencyKey.status_code.is_(None),
+                    IdempotencyKey.expires_at <= now,
+                ),
+            )
+            .values(
+                fingerprint=request_hash,
+                status_code=None,
+                response_body=None,
+                created_at=now,
+                expires_at=expires_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if result.rowcount == 1:
+            return now, None
+
+
+def store_response(
+    db: Session,
+    user_id: int,
+    key: str,
+    claimed_at: datetime,
+    status_code: int,
+    body: str,
+) -> bool:
+    """
+    Write the response of the request owning ``key`` in the current
+    transaction, without committing. Returns ``False`` when the claim made
+    at ``claimed_at`` was taken over or already has a response, and nothing
+    was written.
+    """
+    result = db.execute(
+        update(IdempotencyKey)
+        .where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.created_at == claimed_at,
+            IdempotencyKey.status_code.is_(None),
+        )
+        .values(status_code=status_code, response_body=body)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def complete(
+    db: Session,
+    user_id: int,
+    key: str,
+    claimed_at: datetime,
+    status_code: int,
+    body: str,
+):
+    """Store the response of the request owning ``key``"""
+    store_response(db, user_id, key, claimed_at, status_code, body)
+    db.commit()
+
+
+def release(db: Session, user_id: int, key: str, claimed_at: datetime):
+    """
+    Forget ``key`` after a server error, so a retry runs the request again.
+    A claim that was taken over or already has a response is kept.
+    """
+    db.execute(
+        delete(IdempotencyKey)
+        .where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.created_at == claimed_at,
+            IdempotencyKey.status_code.is_(None),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def purge_expired(db: Session) -> int:
+    """Delete expired keys, returning how many were removed"""
+    result = db.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.expires_at <= datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+_purger: Optional[threading.Thread] = None
+_stop_purger = threading.Event()
+
+
+def start_purger() -> None:
+    """Purge expired keys every ``IDEMPOTENCY_PURGE_INTERVAL`` seconds"""
+    global _purger
+    if _purger is not None or settings.IDEMPOTENCY_PURGE_INTERVAL <= 0:
+        return
+
+    def run():
+        while not _stop_purger.wait(settings.IDEMPOTENCY_PURGE_INTERVAL):
+            try:
+                with SessionLocal() as db:
+                    purged = purge_expired(db)
+                if purged:
+                    logger.info("Purged %s expired idempotency keys", purged)
+            except Exception as e:
+                logger.error("Purging expired idempotency keys failed: %s", e)
+
+    _stop_purger.clear()
+    _purger = threading.Thread(target=run, name="idempotency-purger", daemon=True)
+    _purger.start()
+
+
+def stop_purger() -> None:
+    global _purger
+    if _purger is not None:
+        _stop_purger.set()
+        _purger.join()
+        _purger = None
+
+
+def replay(record: IdempotencyKey) -> RawJSONResponse:
+    return RawJSONResponse(
+        record.response_body,
+        status_code=record.status_code,
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+def _error_body(exc: HTTPException) -> str:
+    return json.dumps({"detail": exc.detail})
+
+
+def _storing_hook(
+    user_id: int,
+    key: str,
+    claimed_at: datetime,
+    response_model: type[BaseModel],
+    stored: list,
+):
+    def before_commit(db: Session, result) -> None:
+        body = response_model.model_validate(result).model_dump_json()
+        if not store_response(db, user_id, key, claimed_at, status.HTTP_200_OK, body):
+            # Another request took the key over, this attempt must not commit
+            raise _still_in_flight()
+        stored.append(body)
+
+    return before_commit
+
+
+def run_idempotent(
+    db: Session,
+    user_id: int,
+    key: str,
+    payload: dict,
+    handler: Callable[[Callable], object],
+    response_model: type[BaseModel],
+):
+    """
+    Run ``handler`` at most once per ``key`` and replay its response.
+
+    A retry whose first attempt is still in flight polls until that attempt
+    finishes, for up to ``IDEMPOTENCY_WAIT_TIMEOUT`` seconds, and then gets
+    409. Successful responses and client errors are stored for
+    ``IDEMPOTENCY_TTL`` seconds; server errors release the key.
+
+    ``handler`` is passed a ``before_commit(db, result)`` hook. Calling it
+    just before committing its changes stores the response in the same
+    transaction, so the changes are never committed without it: an attempt
+    that crashed before committing is retried once its claim goes stale,
+    and one that ran past ``IDEMPOTENCY_LOCK_TIMEOUT`` and lost its claim to
+    a retry fails the hook and rolls back. A handler that does not call the
+    hook has its response stored afterwards, in a separate transaction.
+    """
+    request_hash = fingerprint(payload)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        claimed_at, record = claim(db, user_id, key, request_hash)
+        if record is None:
+            break
+        if record.status_code is not None:
+            return replay(record)
+        if time.monotonic() >= deadline:
+            raise _still_in_flight()
+        time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+
+    stored = []
+    before_commit = _storing_hook(user_id, key, claimed_at, response_model, stored)
+    try:
+        result = handler(before_commit)
+    except HTTPException as e:
+        # Whatever the handler left uncommitted must not go out with the key
+        db.rollback()
+        if e.status_code >= 500:
+            release(db, user_id, key, claimed_at)
+        else:
+            complete(db, user_id, key, claimed_at, e.status_code, _error_body(e))
+        raise
+    except BaseException:
+        db.rollback()
+        release(db, user_id, key, claimed_at)
+        raise
+
+    if stored:
+        return RawJSONResponse(stored[0])
+    body = response_model.model_validate(result).model_dump_json()
+    complete(db, user_id, key, claimed_at, status.HTTP_200_OK, body)
+    return RawJSONResponse(body)
+
+
+async def run_idempotent_async(
+    db: AsyncSession,
+    user_id: int,
+    key: str,
+    payload: dict,
+    handler: Callable[[Callable], Awaitable[object]],
+    response_model: type[BaseModel],
+):
+    """
+    Async counterpart of ``run_idempotent``, the hook is called with the
+    sync session of ``db``, e.g. from ``run_sync``
+    """
+    request_hash = fingerprint(payload)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        claimed_at, record = await db.run_sync(claim, user_id, key, request_hash)
+        if record is None:
+            break
+        if record.status_code is not None:
+            return replay(record)
+        if time.monotonic() >= deadline:
+            raise _still_in_flight()
+        await asyncio.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+
+    stored = []
+    before_commit = _storing_hook(user_id, key, claimed_at, response_model, stored)
+    try:
+        result = await handler(before_commit)
+    except HTTPException as e:
+        await db.rollback()
+        if e.status_code >= 500:
+            await db.run_sync(release, user_id, key, claimed_at)
+        else:
+            await db.run_sync(
+                complete, user_id, key, claimed_at, e.status_code, _error_body(e)
+            )
+        raise
+    except BaseException:
+        await db.rollback()
+        await db.run_sync(release, user_id, key, claimed_at)
+        raise
+
+    if stored:
+        return RawJSONResponse(stored[0])
+    body = response_model.model_validate(result).model_dump_json()
+    await db.run_sync(complete, user_id, key, claimed_at, status.HTTP_200_OK, body)
+    return RawJSONResponse(body)
@@ -0,0 +1,292 @@
+import random
+import threading
+from typing import Callable, Optional
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.orm import Session
+
+from app.cache import product_cache
+from app.config import settings
+from app.database import SessionLocal
+from app.logger import logger
+from app.models import InventoryReservation, Product
+
+
+class MemoryCounterStore:
+    """
+    In-process stand-in for the Redis commands the inventory engine uses
+    (GET, SET NX, INCRBY), with one lock per stripe of keys so counters of
+    different products and shards do not contend.
+    """
+
+    def __init__(self, stripes: int = 64):
+        self._data: dict[str, int] = {}
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _lock(self, key: str) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    def get(self, key: str) -> Optional[int]:
+        return self._data.get(key)
+
+    def set(self, key: str, value: int, nx: bool = False) -> Optional[bool]:
+        with self._lock(key):
+            if nx and key in self._data:
+                return None
+            self._data[key] = int(value)
+            return True
+
+    def incrby(self, key: str, amount: int) -> int:
+        with self._lock(key):
+            value = self._data.get(key, 0) + amount
+            self._data[key] = value
+            return value
+
+
+class InventoryEngine:
+    """
+    Stock reservations against per-product counters instead of the
+    ``products.stock`` rows.
+
+    Every product's available stock is split over ``shards`` counters, so
+    concurrent checkouts of one product mostly decrement different keys. A
+    counter is only decremented by INCRBY and put back right away when that
+    takes it below zero, hence a product is not oversold while its counters
+    last, though two racing checkouts may both be refused when only one had
+    to be.
+
+    Checkouts log what they took as ``InventoryReservation`` rows in the
+    order's transaction, and ``reconcile`` deducts them from
+    ``products.stock`` in batches in the background. Counters are loaded on
+    first use as the stock column minus the pending reservations, which is
+    also how they are rebuilt after a crash lost them. Reservations whose
+    order has not committed yet are invisible to such a rebuild, so
+    counters lost in the middle of checkouts can count that stock twice.
+
+    Every method blocks on the store and the database. Async callers run
+    them in a worker thread, see ``crud.run_blocking``.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        store,
+        shards: int = 8,
+        prefix: str = "ecommerce:inventory:",
+    ):
+        self.session_factory = session_factory
+        self.store = store
+        self.shards = shards
+        self.prefix = prefix
+        self._reconciler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _shard_key(self, product_id: int, shard: int) -> str:
+        return f"{self.prefix}{product_id}:{shard}"
+
+    def _ready_key(self, product_id: int) -> str:
+        return f"{self.prefix}{product_id}:ready"
+
+    def _get(self, key: str) -> Optional[int]:
+        value = self.store.get(key)
+        return None if value is None else int(value)
+
+    def unloaded(self, product_ids) -> list[int]:
+        """Ids of the given products whose counters do not exist yet"""
+        return [pid for pid in product_ids if self._get(self._ready_key(pid)) is None]
+
+    @staticmethod
+    def stock_to_load(product_ids):
+        """
+        Query of ``(product_id, available)`` rows the counters of the given
+        products start from, to run on any session
+        """
+        pending = (
+            select(func.coalesce(func.sum(InventoryReservation.quantity), 0))
+            .where(InventoryReservation.product_id == Product.id)
+            .scalar_subquery()
+        )
+        return select(Product.id, Product.stock - pending).where(
+            Product.id.in_(product_ids)
+        )
+
+    def fill(self, rows) -> None:
+        """Create counters from ``stock_to_load`` rows"""
+        for product_id, available in rows:
+            available = max(available or 0, 0)
+            share, rest = divmod(available, self.shards)
+            # NX keeps counters another process loaded meanwhile
+            for shard in range(self.shards):
+                self.store.set(
+                    self._shard_key(product_id, shard),
+                    share + (shard < rest),
+                    nx=True,
+                )
+            self.store.set(self._ready_key(product_id), 1)
+
+    def load(self, product_ids) -> None:
+        """
+        Create the counters of the given products that do not exist yet,
+        reading the stock on a session of its own
+        """
+        missing = self.unloaded(product_ids)
+        if not missing:
+            return
+        with self.session_factory() as db:
+            rows = db.execute(self.stock_to_load(missing)).all()
+        self.fill(rows)
+
+    def available(self, product_id: int) -> int:
+        self.load([product_id])
+        return sum(
+            self._get(self._shard_key(product_id, shard)) or 0
+            for shard in range(self.shards)
+        )
+
+    def _take(self, product_id: int, quantity: int) -> Optional[list]:
+        """
+        Take ``quantity`` from the product's shards, starting at a random
+        one and moving on while it falls short. Returns what was taken from
+        which counter, or None, with nothing taken, if there is not enough.
+        """
+        taken = []
+        remaining = quantity
+        start = random.randrange(self.shards)
+        for i in range(self.shards):
+            key = self._shard_key(product_id, (start + i) % self.shards)
+            amount = min(self._get(key) or 0, remaining)
+            if amount <= 0:
+                continue
+            if self.store.incrby(key, -amount) < 0:
+                # Another checkout got there first
+                self.store.incrby(key, amount)
+                continue
+            taken.append((key, amount))
+            remaining -= amount
+            if remaining == 0:
+                return taken
+        self._put_back(taken)
+        return None
+
+    def _put_back(self, taken: list) -> None:
+        for key, amount in taken:
+            self.store.incrby(key, amount)
+
+    def reserve(self, quantities: dict[int, int]) -> list[int]:
+        """
+        Reserve every line or none. Returns the ids of the products that
+        had too little stock, empty when everything was reserved. Counters
+        must have been loaded, products without them have no stock.
+        """
+        taken = []
+        insufficient = []
+        for product_id, quantity in quantities.items():
+            line = self._take(product_id, quantity)
+            if line is None:
+                insufficient.append(product_id)
+            else:
+                taken.extend(line)
+        if insufficient:
+            self._put_back(taken)
+        return insufficient
+
+    def release(self, quantities: dict[int, int]) -> None:
+        """Give stock back, e.g. of a failed checkout or order"""
+        for product_id, quantity in quantities.items():
+            # Counters loaded later read the stock column, which has it
+            if self._get(self._ready_key(product_id)) is None:
+                continue
+            shard = random.randrange(self.shards)
+            self.store.incrby(self._shard_key(product_id, shard), quantity)
+
+    def reconcile(self, limit: Optional[int] = None) -> int:
+        """
+        Deduct up to ``limit`` pending reservations from ``products.stock``
+        in one transaction, returning how many were applied. Rows locked by
+        another process's reconciliation are skipped on PostgreSQL.
+        """
+        limit = limit or settings.INVENTORY_RECONCILE_BATCH
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(
+                    InventoryReservation.id,
+                    InventoryReservation.product_id,
+                    InventoryReservation.quantity,
+                )
+                .order_by(InventoryReservation.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not rows:
+                return 0
+            deltas: dict[int, int] = {}
+            for _, product_id, quantity in rows:
+                deltas[product_id] = deltas.get(product_id, 0) + quantity
+            db.execute(
+                update(Product)
+                .where(Product.id.in_(deltas))
+                .values(stock=Product.stock - case(deltas, value=Product.id))
+                .execution_options(synchronize_session=False)
+            )
+            db.execute(
+                delete(InventoryReservation)
+                .where(InventoryReservation.id.in_([row.id for row in rows]))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        # Stock levels changed, cached catalog pages are stale
+        product_cache.invalidate()
+        return len(rows)
+
+    def recover(self) -> int:
+        """Apply every reservation a previous process left pending"""
+        total = 0
+        while applied := self.reconcile():
+            total += applied
+        if total:
+            logger.info("Reconciled %s pending inventory reservations", total)
+        return total
+
+    def start(self) -> None:
+        if self._reconciler is not None:
+            return
+
+        def run():
+            while not self._stop.wait(settings.INVENTORY_RECONCILE_INTERVAL):
+                try:
+                    self.recover()
+                except Exception as e:
+                    logger.error("Inventory reconciliation failed: %s", e)
+
+        self._stop.clear()
+        self._reconciler = threading.Thread(target=run, name="inventory", daemon=True)
+        self._reconciler.start()
+
+    def stop(self) -> None:
+        """Stop the reconciler after applying what is pending"""
+        if self._reconciler is not None:
+            self._stop.set()
+            self._reconciler.join()
+            self._reconciler = None
+            self.recover()
+
+
+def create_inventory_engine() -> Optional[InventoryEngine]:
+    """Build the engine selected by ``settings.INVENTORY_BACKEND``, if any"""
+    backend = settings.INVENTORY_BACKEND
+    if not backend:
+        return None
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("INVENTORY_BACKEND=redis requires the redis package")
+        store = redis.Redis.from_url(settings.REDIS_URL)
+    elif backend == "memory":
+        store = MemoryCounterStore()
+    else:
+        raise RuntimeError(f"Unknown INVENTORY_BACKEND: {backend}")
+    return InventoryEngine(SessionLocal, store, shards=settings.INVENTORY_SHARDS)
+
+
+inventory_engine = create_inventory_engine()
@@ -1,40 +1,110 @@
+import atexit
+import json
 import logging
-from logging.config import dictConfig
-
-# Define logging configuration
-LOGGING_CONFIG = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "default": {
-            "format": "[%(asctime)s] [%(levelname)s] %(message)s",
-            "datefmt": "%Y-%m-%d %H:%M:%S",
-        },
-        "detailed": {
-            "format": "[%(asctime)s] [%(levelname)s] %(message)s",
-            "datefmt": "%Y-%m-%d %H:%M:%S",
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "default",
-        },
-        "file": {
-            "class": "logging.FileHandler",
-            "filename": "logs/app.log",
-            "formatter": "detailed",
-            "mode": "a",  # Append mode
-        },
-    },
-    "root": {
-        "level": "INFO",
-        "handlers": ["console", "file"],
-    },
-}
-
-# Apply logging configuration
-dictConfig(LOGGING_CONFIG)
+import os
+import queue
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from app.config import settings
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Correlation id of the request being served, set by the timing middleware
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Whether INFO records of the current request are kept, see LOG_SAMPLE_RATE
+log_sampled_var: ContextVar[bool] = ContextVar("log_sampled", default=True)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request id and structured extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            data["request_id"] = request_id
+        http = getattr(record, "http", None)
+        if http is not None:
+            data["http"] = http
+        return json.dumps(data, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Attach the request id to records and drop INFO and lower records of
+    requests that were not sampled. Runs on the caller's thread, where the
+    request context is still available.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not log_sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> None:
+    """
+    Route all records through a queue to a background listener thread.
+
+    Callers still format the record, ``QueueHandler.prepare`` does that
+    before enqueueing it, but the console and file writes happen on the
+    listener.
+    Called by the app's lifespan rather than on import, until then records
+    of WARNING and above go to stderr.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = (
+        JsonFormatter()
+        if settings.LOG_JSON
+        else logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    )
+    handlers = [logging.StreamHandler()]
+    if settings.LOG_FILE:
+        os.makedirs(os.path.dirname(settings.LOG_FILE) or ".", exist_ok=True)
+        handlers.append(logging.FileHandler(settings.LOG_FILE, mode="a"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(settings.LOG_LEVEL)
+    root.handlers = [queue_handler]
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 
 # Create logger instance
 logger = logging.getLogger("ecommerce")
+
+# One record per HTTP request, emitted by the timing middleware
+access_logger = logging.getLogger("ecommerce.access")
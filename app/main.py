@@ -1,44 +1,80 @@
-import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
-from starlette.middleware.base import BaseHTTPMiddleware
-
-from app import models
-from app.database import engine
-from app.logger import logger
-from app.routes import order_routes, product_routes, user_routes
-
-
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
-
-        logger.info(f"{request.method} {request.url.path} - ")
-
-        logger.info(f"{response.status_code} (Processed in {process_time:.2f}s)")
-        return response
-
-
-app = FastAPI()
-models.Base.metadata.create_all(bind=engine)
-app.add_middleware(LoggingMiddleware)
-
-
-@app.on_event("startup")
-async def startup_event():
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+
+from app.database import (
+    DATABASE_ASYNC,
+    async_engine,
+    async_replica_engines,
+    engine,
+    pool_status,
+    replica_engines,
+)
+from app.hashing import hashing_executor
+from app.idempotency import start_purger, stop_purger
+from app.inventory import inventory_engine
+from app.logger import logger, setup_logging, shutdown_logging
+from app.metrics import REGISTRY
+from app.middleware import TimingMiddleware
+from app.order_processing import order_worker
+from app.routes import (
+    async_order_routes,
+    async_product_routes,
+    async_user_routes,
+    order_routes,
+    product_routes,
+    user_routes,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Acquire the process's resources when the server starts, not on import,
+    so importing the app stays cheap and needs no database. The schema is
+    managed by Alembic (``alembic upgrade head``), not created here.
+    """
+    setup_logging()
     logger.info("Starting FastAPI application")
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
+    REGISTRY.start_flusher()
+    if inventory_engine is not None:
+        inventory_engine.recover()
+        inventory_engine.start()
+    order_worker.start()
+    order_worker.recover()
+    start_purger()
+    yield
     logger.info("Shutting down FastAPI application")
-
-
-app.include_router(user_routes.router)
-app.include_router(product_routes.router)
-app.include_router(order_routes.router)
+    hashing_executor.shutdown()
+    stop_purger()
+    order_worker.stop()
+    if inventory_engine is not None:
+        inventory_engine.stop()
+    REGISTRY.stop_flusher()
+    for sync_engine in (engine, *replica_engines):
+        sync_engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+    for replica in async_replica_engines:
+        await replica.dispose()
+    shutdown_logging()
+
+
+# orjson encodes response bodies several times faster than the stdlib encoder
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.add_middleware(TimingMiddleware)
+
+
+# Async routers keep requests off the threadpool while they wait on the database
+if DATABASE_ASYNC:
+    app.include_router(async_user_routes.router)
+    app.include_router(async_product_routes.router)
+    app.include_router(async_order_routes.router)
+else:
+    app.include_router(user_routes.router)
+    app.include_router(product_routes.router)
+    app.include_router(order_routes.router)
 
 
 # Root endpoint
@@ -53,3 +89,32 @@ def read_root():
     """
     logger.info("Root endpoint accessed")
     return {"message": "Server is running. Visit /docs for API documentation."}
+
+
+@app.get("/health/db-pool", tags=["Health"])
+def read_db_pool():
+    """
+    Connection pool saturation gauges.
+
+    Returns:
+        dict: Per engine pool size, checked in/out and overflow connections,
+              callers currently waiting for a connection and checkout
+              timeouts since startup.
+    """
+    return pool_status()
+
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+def read_metrics():
+    """
+    Metrics in the Prometheus text exposition format.
+
+    Returns:
+        PlainTextResponse: Request counts, latency and query count
+              histograms per route, in-flight requests, checkout results and
+              connection pool gauges, aggregated over all worker processes
+              when `METRICS_MULTIPROC_DIR` is set.
+    """
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
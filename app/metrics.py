@@ -0,0 +1,329 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+from app.config import settings
+from app.database import pool_status
+from app.logger import logger
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    2.5,
+    5.0,
+    7.5,
+    10.0,
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+class Metric:
+    """A named family of samples keyed by label values"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(key), _copy(value)] for key, value in self._values.items()]
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labels": list(self.labelnames),
+            "values": values,
+        }
+
+
+def _copy(value):
+    return [list(value[0]), value[1], value[2]] if isinstance(value, list) else value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, **kw
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, **kw)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> dict:
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class Registry:
+    """
+    Holds the metrics of this process and renders the text exposition format.
+
+    With ``METRICS_MULTIPROC_DIR`` set, every worker process writes its
+    snapshot to a file in that directory, at most ``METRICS_FLUSH_INTERVAL``
+    seconds old, and a scrape served by any worker merges all of them.
+    Counters and histograms are summed over every process that ever wrote
+    a file, gauges only over processes that are still alive.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def register(self, metric: Metric) -> None:
+        self._metrics[metric.name] = metric
+
+    def register_collector(self, collector: Callable[[], None]) -> None:
+        """Add a callback that refreshes gauges right before a snapshot"""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        for collector in self._collectors:
+            collector()
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    # Multiprocess support
+
+    def _snapshot_path(self, directory: str, pid: int) -> str:
+        return os.path.join(directory, f"metrics_{pid}.json")
+
+    def flush(self) -> None:
+        """Write this process's snapshot to the multiprocess directory"""
+        directory = settings.METRICS_MULTIPROC_DIR
+        if not directory:
+            return
+        data = json.dumps({"pid": os.getpid(), "metrics": self.snapshot()})
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self._snapshot_path(directory, os.getpid()))
+
+    def start_flusher(self) -> None:
+        if not settings.METRICS_MULTIPROC_DIR or self._flusher is not None:
+            return
+
+        def run():
+            while not self._stop.wait(settings.METRICS_FLUSH_INTERVAL):
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error("Flushing metrics failed: %s", e)
+
+        self._stop.clear()
+        self._flusher = threading.Thread(target=run, name="metrics", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def stop_flusher(self) -> None:
+        if self._flusher is not None:
+            self._stop.set()
+            self._flusher.join()
+            self._flusher = None
+            self.flush()
+
+    def _collect_all(self) -> dict:
+        directory = settings.METRICS_MULTIPROC_DIR
+        if not directory:
+            return self.snapshot()
+
+        self.flush()
+        merged: dict = {}
+        for filename in sorted(os.listdir(directory)):
+            if not (filename.startswith("metrics_") and filename.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(data["pid"])
+            for name, metric in data["metrics"].items():
+                if metric["type"] == "gauge" and not alive:
+                    continue
+                _merge(merged, name, metric)
+        return merged
+
+    def render(self) -> str:
+        return render(self._collect_all())
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(merged: dict, name: str, metric: dict) -> None:
+    target = merged.setdefault(name, {**metric, "values": []})
+    values = {tuple(labels): value for labels, value in target["values"]}
+    for labels, value in metric["values"]:
+        key = tuple(labels)
+        current = values.get(key)
+        if current is None:
+            values[key] = _copy(value)
+        elif isinstance(value, list):
+            current[0] = [a + b for a, b in zip(current[0], value[0])]
+            current[1] += value[1]
+            current[2] += value[2]
+        else:
+            values[key] = current + value
+    target["values"] = [[list(key), value] for key, value in values.items()]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value))
+
+
+def render(snapshot: dict) -> str:
+    """Render a snapshot in the Prometheus text exposition format"""
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric["labels"]
+        for labels, value in metric["values"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(metric["buckets"], counts):
+                cumulative += bucket_count
+                le = _labels(names, labels, f'le="{_number(bound)}"')
+                lines.append(f"{name}_bucket{le} {_number(cumulative)}")
+            le = _labels(names, labels, 'le="+Inf"')
+            lines.append(f"{name}_bucket{le} {_number(count)}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(names, labels)} {_number(count)}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Application metrics
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by method, route template and status code",
+    ("method", "route", "status"),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by method and route template",
+    ("method", "route"),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being served", ("method",)
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed per HTTP request",
+    ("route",),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+CHECKOUTS = Counter(
+    "checkouts_total",
+    "Checkouts by result: success, insufficient_stock, invalid or error",
+    ("result",),
+)
+ORDER_TRANSITIONS = Counter(
+    "order_transitions_total",
+    "Orders moved to a status by the order processing pipeline",
+    ("status",),
+)
+ORDER_QUEUE_DEPTH = Gauge(
+    "order_queue_depth", "Orders waiting for the local order processing workers"
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connection pool state by engine: size, checkedin, checkedout, overflow, "
+    "waiting and timeouts",
+    ("engine", "state"),
+)
+
+
+def _collect_pool_metrics() -> None:
+    for engine_name, stats in pool_status().items():
+        for state, value in stats.items():
+            if state != "class":
+                DB_POOL_CONNECTIONS.set(value, engine=engine_name, state=state)
+
+
+REGISTRY.register_collector(_collect_pool_metrics)
@@ -0,0 +1,123 @@
+import logging
+import random
+import uuid
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.logger import access_logger, log_sampled_var, logger, request_id_var
+from app.metrics import (
+    DB_QUERIES_PER_REQUEST,
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS,
+    HTTP_REQUESTS_IN_PROGRESS,
+)
+from app.timing import (
+    RepeatedStatementError,
+    end_request_timings,
+    start_request_timings,
+)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+class TimingMiddleware:
+    """
+    Pure ASGI middleware that times each HTTP request.
+
+    It adds a ``Server-Timing`` header breaking the request down into the
+    phases recorded through ``app.timing`` (db, auth, serialize) and emits a
+    single access log record once the response is complete. It also sets
+    the request id used to correlate log records, taken from the
+    ``X-Request-ID`` header or generated, and decides whether the INFO
+    records of the request are sampled, and records the request metrics
+    labelled by route template. Statements repeated more than
+    ``SQL_REPEAT_THRESHOLD`` times in one request are reported as a likely
+    N+1 pattern. Unlike ``BaseHTTPMiddleware`` it passes messages straight
+    through, so streaming responses are not buffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get(REQUEST_ID_HEADER, "")[:128]
+        request_id = request_id or uuid.uuid4().hex
+        request_id_token = request_id_var.set(request_id)
+        sampled_token = log_sampled_var.set(
+            settings.LOG_SAMPLE_RATE >= 1.0
+            or random.random() < settings.LOG_SAMPLE_RATE
+        )
+        timings, token = start_request_timings()
+        status_code = 500
+        method = scope["method"]
+        HTTP_REQUESTS_IN_PROGRESS.inc(method=method)
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                timings.finish_serialization()
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing())
+                headers[REQUEST_ID_HEADER] = request_id
+                if settings.DEBUG:
+                    db_ms = timings.phases.get("db", 0) / 1e6
+                    headers["X-DB-Query-Count"] = str(timings.queries)
+                    headers["X-DB-Time-ms"] = f"{db_ms:.2f}"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            duration_ms = timings.elapsed_ns() / 1e6
+            end_request_timings(token)
+            HTTP_REQUESTS_IN_PROGRESS.dec(method=method)
+            # Templates such as /orders/{order_id} keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            HTTP_REQUESTS.inc(method=method, route=route, status=status_code)
+            HTTP_REQUEST_DURATION.observe(duration_ms / 1e3, method=method, route=route)
+            DB_QUERIES_PER_REQUEST.observe(timings.queries, route=route)
+            # Server errors are never sampled out
+            access_logger.log(
+                logging.ERROR if status_code >= 500 else logging.INFO,
+                "%s %s %s %.2fms",
+                scope["method"],
+                scope["path"],
+                status_code,
+                duration_ms,
+                extra={
+                    "http": {
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 3),
+                        "queries": timings.queries,
+                        "timings_ms": {
+                            name: round(ms, 3) for name, ms in timings.as_ms().items()
+                        },
+                    }
+                },
+            )
+            repeated = timings.query_stats.repeated(settings.SQL_REPEAT_THRESHOLD)
+            for statement, count in repeated.items():
+                logger.warning(
+                    "Possible N+1 in %s %s, statement ran %s times: %s",
+                    method,
+                    route,
+                    count,
+                    statement,
+                )
+            log_sampled_var.reset(sampled_token)
+            request_id_var.reset(request_id_token)
+
+        if repeated and settings.SQL_REPEAT_RAISE:
+            raise RepeatedStatementError(
+                f"{method} {route} repeated {len(repeated)} statement(s) more than "
+                f"{settings.SQL_REPEAT_THRESHOLD} times"
+            )
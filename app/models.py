@@ -1,8 +1,22 @@
-from sqlalchemy import Column, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    DDL,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    Numeric,
+    String,
+    Text,
+    event,
+)
 from sqlalchemy.orm import relationship
 
 from .database import Base
 
+# Money is stored exactly, in units with two decimal places
+MONEY = Numeric(12, 2)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -21,7 +35,7 @@ class Product(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     description = Column(String)
-    price = Column(Float)
+    price = Column(MONEY)
     stock = Column(Integer)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
@@ -32,13 +46,65 @@ class Product(Base):
         return f"<Product {self.name}>"
 
 
+# Full-text search over name and description. PostgreSQL indexes this exact
+# expression with GIN, so queries must use it verbatim to hit the index.
+PRODUCT_SEARCH_DOCUMENT = (
+    "to_tsvector('english'::regconfig, "
+    "coalesce(name, '') || ' ' || coalesce(description, ''))"
+)
+
+event.listen(
+    Product.__table__,
+    "after_create",
+    DDL(
+        "CREATE INDEX ix_products_search ON products "
+        f"USING gin (({PRODUCT_SEARCH_DOCUMENT}))"
+    ).execute_if(dialect="postgresql"),
+)
+
+# SQLite has no tsvector, an FTS5 table mirrors the searchable columns
+# instead and triggers keep it in sync. Stock updates do not touch it.
+_PRODUCTS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE products_fts USING fts5(name, description, "
+    "content='products', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER products_fts_update AFTER UPDATE OF name, description "
+    "ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+)
+for _statement in _PRODUCTS_FTS_DDL:
+    event.listen(
+        Product.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    Product.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS products_fts").execute_if(dialect="sqlite"),
+)
+
+
 class Order(Base):
     __tablename__ = "orders"
+    # Serves the per-user keyset pagination of GET /orders/
+    __table_args__ = (Index("ix_orders_user_id_id", "user_id", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    total_price = Column(Float)
+    total_price = Column(MONEY)
     status = Column(String, default="pending")
+    # When an order worker took the order for its current step, empty while
+    # no worker holds it (see app.order_processing)
+    claimed_at = Column(DateTime)
 
     user = relationship("User", back_populates="orders")
     order_items = relationship("OrderItem", back_populates="order")
@@ -51,12 +117,46 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), primary_key=True)
-    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer)
+    # Price of the product when the order was placed
+    unit_price = Column(MONEY, nullable=False)
 
     # Relationship to the Order model
     order = relationship("Order", back_populates="order_items")
 
     # Relationship to the Product model
     product = relationship("Product", back_populates="order_items")
+
+
+class IdempotencyKey(Base):
+    """Response of a request sent with an ``Idempotency-Key``, per user"""
+
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    # Hash of the request body, a key may not be reused for another request
+    fingerprint = Column(String(64), nullable=False)
+    # Both stay empty while the first request is in flight
+    status_code = Column(Integer)
+    response_body = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class InventoryReservation(Base):
+    """
+    Stock a checkout took from the inventory counters (see app.inventory)
+    that is not yet deducted from ``products.stock``. Rows are written with
+    the order and deleted once reconciled, so after a crash the pending rows
+    tell how far the stock column is behind.
+    """
+
+    __tablename__ = "inventory_reservations"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    quantity = Column(Integer, nullable=False)
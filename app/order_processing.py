@@ -0,0 +1,287 @@
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from app import crud, inventory
+from app.cache import product_cache
+from app.config import settings
+from app.database import SessionLocal
+from app.logger import logger
+from app.metrics import ORDER_QUEUE_DEPTH, ORDER_TRANSITIONS, REGISTRY
+from app.models import Order
+
+PENDING = "pending"
+CONFIRMED = "confirmed"
+SHIPPED = "shipped"
+FAILED = "failed"
+
+
+def authorize_payment(order: Order) -> None:
+    """Stand-in for the payment provider, approves every order"""
+    logger.info("Payment of %.2f authorized for order %s", order.total_price, order.id)
+
+
+def fulfill(order: Order) -> None:
+    """Stand-in for handing the order to the warehouse"""
+    logger.info("Order %s handed over for fulfillment", order.id)
+
+
+def notify(order: Order, status: str) -> None:
+    """Stand-in for telling the customer about a status change"""
+    logger.info("Notified user %s that order %s is %s", order.user_id, order.id, status)
+
+
+# Each step runs while the order is in the first status and moves it to the
+# second. Steps may run again when a worker dies mid-step, so they must be
+# idempotent.
+PIPELINE: tuple[tuple[str, str, Callable[[Order], None]], ...] = (
+    (PENDING, CONFIRMED, authorize_payment),
+    (CONFIRMED, SHIPPED, fulfill),
+)
+
+
+def _claim_expired():
+    return or_(
+        Order.claimed_at.is_(None),
+        Order.claimed_at
+        <= datetime.utcnow() - timedelta(seconds=settings.ORDER_CLAIM_TIMEOUT),
+    )
+
+
+def claim(db: Session, order_id: int, status: str) -> Optional[datetime]:
+    """
+    Take an order in ``status`` for running its step, left to the caller to
+    commit.
+
+    The update only applies while no other worker holds the order, or its
+    claim is older than ``ORDER_CLAIM_TIMEOUT``, so every step runs in one
+    worker at a time even when several processes recover the same orders.
+    Returns the claim's timestamp, None if the order was not taken.
+    """
+    claimed_at = datetime.utcnow()
+    result = db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == status, _claim_expired())
+        .values(claimed_at=claimed_at)
+        .execution_options(synchronize_session=False)
+    )
+    return claimed_at if result.rowcount == 1 else None
+
+
+def release_claim(db: Session, order_id: int, claimed_at: datetime) -> None:
+    """Give up a claim, e.g. after a failed step, left to the caller to commit"""
+    db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.claimed_at == claimed_at)
+        .values(claimed_at=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def transition(
+    db: Session,
+    order_id: int,
+    from_status: str,
+    to_status: str,
+    claimed_at: datetime,
+) -> bool:
+    """
+    Move an order claimed at ``claimed_at`` from ``from_status`` to
+    ``to_status`` and release the claim, left to the caller to commit.
+
+    The update only applies while the order is still in ``from_status`` and
+    the claim was not taken over, so an order moves through every status
+    once. Returns whether this call moved it.
+    """
+    result = db.execute(
+        update(Order)
+        .where(
+            Order.id == order_id,
+            Order.status == from_status,
+            Order.claimed_at == claimed_at,
+        )
+        .values(status=to_status, claimed_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    ORDER_TRANSITIONS.inc(status=to_status)
+    return True
+
+
+class OrderWorker:
+    """
+    Local order processing queue served by background threads.
+
+    Checkout only reserves stock and enqueues the order id, the payment,
+    fulfillment and notification steps of ``PIPELINE`` run here, outside
+    the request. Every step runs under a claim on the order (see ``claim``),
+    so an order queued by several processes is still processed once. The
+    queue lives in memory, so ``recover`` re-enqueues the orders a previous
+    process left unfinished, and the orders of workers that died mid-step
+    are picked up again once their claims expire. A step that keeps failing
+    after ``ORDER_MAX_ATTEMPTS`` tries marks the order as failed and puts
+    its stock back.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        workers: int = 1,
+        maxsize: int = 0,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self._queue: queue.Queue[Optional[int]] = queue.Queue(maxsize)
+        self._threads: list[threading.Thread] = []
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"orders-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        def watch():
+            while not self._stop.wait(settings.ORDER_CLAIM_TIMEOUT):
+                try:
+                    self.recover(abandoned_only=True)
+                except Exception as e:
+                    logger.error("Recovering abandoned orders failed: %s", e)
+
+        self._stop.clear()
+        self._watcher = threading.Thread(target=watch, name="orders-watch", daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        """Finish the orders already queued, then stop the threads"""
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def enqueue(self, order_id: int) -> bool:
+        """
+        Queue an order for processing. When the workers are not running or
+        the queue is full the order is left as is for ``recover`` to pick up,
+        and False is returned.
+        """
+        if not self._threads:
+            return False
+        try:
+            self._queue.put_nowait(order_id)
+        except queue.Full:
+            logger.warning("Order queue full, order %s left for recovery", order_id)
+            return False
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def join(self) -> None:
+        """Wait until every queued order has been processed"""
+        self._queue.join()
+
+    def recover(self, abandoned_only: bool = False) -> int:
+        """
+        Enqueue every order that has not gone through the pipeline yet and
+        that no live worker holds. With ``abandoned_only`` only orders whose
+        claim expired are picked up, leaving those still waiting in the queue
+        of some process alone.
+        """
+        unfinished = [from_status for from_status, _, _ in PIPELINE]
+        stmt = select(Order.id).where(Order.status.in_(unfinished), _claim_expired())
+        if abandoned_only:
+            stmt = stmt.where(Order.claimed_at.is_not(None))
+        with self.session_factory() as db:
+            order_ids = db.scalars(stmt.order_by(Order.id)).all()
+        for order_id in order_ids:
+            self.enqueue(order_id)
+        if order_ids:
+            logger.info("Recovered %s unfinished orders", len(order_ids))
+        return len(order_ids)
+
+    def _run(self) -> None:
+        while True:
+            order_id = self._queue.get()
+            try:
+                if order_id is None:
+                    return
+                self.process(order_id)
+            finally:
+                self._queue.task_done()
+
+    def process(self, order_id: int) -> None:
+        """Run the pipeline for one order, retrying failed steps"""
+        for attempt in range(1, settings.ORDER_MAX_ATTEMPTS + 1):
+            try:
+                self._process(order_id)
+                return
+            except Exception as e:
+                logger.warning(
+                    "Processing order %s failed (attempt %s): %s", order_id, attempt, e
+                )
+                if attempt < settings.ORDER_MAX_ATTEMPTS:
+                    time.sleep(settings.ORDER_RETRY_DELAY * attempt)
+
+        logger.error("Giving up on order %s", order_id)
+        with self.session_factory() as db:
+            for from_status, _, _ in PIPELINE:
+                claimed_at = claim(db, order_id, from_status)
+                if claimed_at is None:
+                    continue
+                if transition(db, order_id, from_status, FAILED, claimed_at):
+                    quantities = crud.release_order_stock(db, order_id)
+                    db.commit()
+                    if inventory.inventory_engine is not None:
+                        inventory.inventory_engine.release(quantities)
+                    product_cache.invalidate()
+                    break
+
+    def _process(self, order_id: int) -> None:
+        with self.session_factory() as db:
+            order = db.get(Order, order_id)
+            if order is None:
+                return
+            for from_status, to_status, step in PIPELINE:
+                if order.status != from_status:
+                    continue
+                claimed_at = claim(db, order_id, from_status)
+                db.commit()
+                if claimed_at is None:
+                    # Another worker has it or got there first
+                    return
+                try:
+                    step(order)
+                except Exception:
+                    db.rollback()
+                    release_claim(db, order_id, claimed_at)
+                    db.commit()
+                    raise
+                if not transition(db, order_id, from_status, to_status, claimed_at):
+                    # The claim expired and another worker took over
+                    db.rollback()
+                    return
+                db.commit()
+                db.refresh(order)
+                notify(order, to_status)
+
+
+order_worker = OrderWorker(
+    SessionLocal, workers=settings.ORDER_WORKERS, maxsize=settings.ORDER_QUEUE_SIZE
+)
+
+REGISTRY.register_collector(lambda: ORDER_QUEUE_DEPTH.set(order_worker.depth()))
@@ -0,0 +1,43 @@
+import base64
+import binascii
+import json
+from typing import Optional
+
+from fastapi import HTTPException, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    """Build an opaque cursor pointing just after the row with ``last_id``"""
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Return the last seen id from a cursor, raising 400 if it is malformed"""
+    if cursor is None:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded))["id"]
+        if not isinstance(last_id, int):
+            raise ValueError(last_id)
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+
+def next_cursor_headers(count: int, last_id: Optional[int], limit: int) -> dict:
+    """Header advertising the cursor of the next page when this page is full"""
+    if count and count >= limit:
+        return {NEXT_CURSOR_HEADER: encode_cursor(last_id)}
+    return {}
+
+
+def set_next_cursor(response: Response, items: list, limit: int) -> None:
+    """Advertise the cursor of the next page when this page is full"""
+    if items:
+        last = items[-1]
+        last_id = last["id"] if isinstance(last, dict) else last.id
+        response.headers.update(next_cursor_headers(len(items), last_id, limit))
@@ -0,0 +1,71 @@
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from app import auth, database
+from app.cache import TTLCache, create_backend
+from app.config import settings
+
+# Users who checked out within READ_YOUR_WRITES_WINDOW. Shared by the worker
+# processes through Redis when that is the cache backend; entries are tiny,
+# so the in-process store is sized to never evict one before it expires
+recent_writers = (
+    create_backend()
+    if settings.CACHE_BACKEND == "redis"
+    else TTLCache(maxsize=100_000, ttl=settings.READ_YOUR_WRITES_WINDOW)
+)
+
+
+def _recent_write_key(user_id: int) -> str:
+    return f"recent-write:{user_id}"
+
+
+def record_write(user_id: int) -> None:
+    """Keep the user's reads on the primary for ``READ_YOUR_WRITES_WINDOW``"""
+    if settings.READ_YOUR_WRITES_WINDOW > 0:
+        recent_writers.set(
+            _recent_write_key(user_id), True, ttl=settings.READ_YOUR_WRITES_WINDOW
+        )
+
+
+def wrote_recently(user_id: Optional[int]) -> bool:
+    return (
+        user_id is not None
+        and recent_writers.get(_recent_write_key(user_id)) is not None
+    )
+
+
+def _request_user_id(request: Request) -> Optional[int]:
+    """User id of the request's bearer token, None if it has no valid one"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return auth.decode_request_token(request, token)[0]
+    except HTTPException:
+        return None
+
+
+def get_read_db(request: Request):
+    """
+    Session for read-only endpoints, which reads from a replica unless the
+    requesting user checked out within ``READ_YOUR_WRITES_WINDOW``.
+    """
+    use_replicas = not wrote_recently(_request_user_id(request))
+    db = database.SessionLocal(use_replicas=use_replicas)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    """Async counterpart of ``get_read_db``"""
+    user_id = _request_user_id(request)
+    # With Redis the lookup is a round trip, kept off the event loop
+    use_replicas = user_id is None or not await run_in_threadpool(
+        wrote_recently, user_id
+    )
+    async with database.AsyncSessionLocal(use_replicas=use_replicas) as db:
+        yield db
@@ -0,0 +1,163 @@
+from typing import Literal, Optional, Union
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app import auth, crud, models, schemas
+from app.database import get_async_db
+from app.idempotency import run_idempotent_async
+from app.logger import logger
+from app.metrics import CHECKOUTS
+from app.order_processing import order_worker
+from app.pagination import decode_cursor, set_next_cursor
+from app.replication import get_async_read_db, record_write
+from app.serialization import RawJSONResponse, dump_rows
+from app.timing import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+
+@router.post("/orders/", response_model=schemas.OrderResponse)
+async def create_order(
+    order: schemas.OrderCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(auth.get_current_user_async),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    """
+    Create an order, ensuring the logged-in user is associated with it.
+
+    With an `Idempotency-Key` header the order is placed at most once per key
+    and user. Retries get the stored response, marked with
+    `Idempotent-Replayed: true`, and a retry arriving while the first attempt
+    is still running waits for it.
+    """
+    if idempotency_key is None:
+        return await _place_order(order, db, current_user)
+    return await run_idempotent_async(
+        db,
+        current_user.id,
+        idempotency_key,
+        order.model_dump(),
+        lambda before_commit: _place_order(order, db, current_user, before_commit),
+        schemas.OrderResponse,
+    )
+
+
+async def _place_order(
+    order: schemas.OrderCreate,
+    db: AsyncSession,
+    current_user: models.User,
+    before_commit=None,
+):
+    logger.info("User %s placing an order", current_user.id)
+    try:
+        # The checkout logic is shared with the sync router through run_sync
+        db_order = await db.run_sync(
+            crud.create_order,
+            order=order,
+            user_id=current_user.id,
+            before_commit=before_commit,
+        )
+    except HTTPException:
+        await db.rollback()
+        raise
+    except crud.InsufficientStockError as e:
+        await db.rollback()
+        CHECKOUTS.inc(result="insufficient_stock")
+        logger.warning("%s", e)
+        raise HTTPException(status_code=400, detail=e.lines)
+    except ValueError as e:
+        await db.rollback()
+        CHECKOUTS.inc(result="invalid")
+        logger.warning("%s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await db.rollback()
+        CHECKOUTS.inc(result="error")
+        logger.error("Error creating order: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    CHECKOUTS.inc(result="success")
+    # Replicas may lag behind, the user's next reads go to the primary
+    await run_in_threadpool(record_write, current_user.id)
+    # Payment, fulfillment and notification happen in the background
+    order_worker.enqueue(db_order.id)
+    logger.info("Order %s created successfully", db_order.id)
+    return db_order
+
+
+@router.get(
+    "/orders/",
+    response_model=list[Union[schemas.OrderDetailResponse, schemas.OrderResponse]],
+)
+async def get_orders(
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    expand: Optional[Literal["items"]] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: models.User = Depends(auth.get_current_principal_async),
+):
+    """
+    Retrieve a list of orders for the logged-in user.
+
+    Args:
+        skip (int): Number of orders to skip for pagination. Defaults to 0.
+        limit (int): Maximum number of orders to return. Defaults to 100.
+        cursor (str, optional): `X-Next-Cursor` of the previous page. When
+            given, `skip` is ignored and the page is found by keyset seek.
+        expand (str, optional): `items` to include every order's line items
+            and product summaries, as in `GET /orders/{order_id}`.
+        db (AsyncSession): Database session injected via `get_async_read_db`,
+            reading from a replica if there are any.
+        current_user (models.User): The currently authenticated user.
+
+    Returns:
+        list[schemas.OrderResponse]: List of the user's orders, as
+        `schemas.OrderDetailResponse` with `expand=items`. A full page
+        carries the cursor of the next page in the `X-Next-Cursor` header.
+    """
+    schema = schemas.OrderDetailResponse if expand else schemas.OrderResponse
+    logger.info("Fetching orders for user %s", current_user.id)
+    orders = await db.run_sync(
+        crud.get_orders,
+        user_id=current_user.id,
+        skip=skip,
+        limit=limit,
+        after_id=decode_cursor(cursor),
+        with_items=expand is not None,
+    )
+    response = RawJSONResponse(dump_rows(schema, orders))
+    set_next_cursor(response, orders, limit)
+    logger.info("Retrieved %s orders", len(orders))
+    return response
+
+
+@router.get("/orders/{order_id}", response_model=schemas.OrderDetailResponse)
+async def get_order(
+    order_id: int,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: models.User = Depends(auth.get_current_principal_async),
+):
+    """
+    Retrieve one of the logged-in user's orders with its line items.
+
+    Args:
+        order_id (int): Id of the order.
+        db (AsyncSession): Database session injected via `get_async_read_db`,
+            reading from a replica if there are any.
+        current_user (models.User): The currently authenticated user.
+
+    Returns:
+        schemas.OrderDetailResponse: The order with every line item and a
+        summary of its product. Orders of other users are reported as not
+        found.
+    """
+    order = await db.run_sync(
+        crud.get_order, order_id=order_id, user_id=current_user.id
+    )
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import auth, models, schemas
+from app.database import get_async_db
+from app.logger import logger
+from app.timing import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+
+@router.post("/register/", response_model=schemas.UserResponse)
+async def register_user(
+    user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)
+):
+    """Register a new user"""
+    logger.info("Registering user with email: %s", user.email)
+    existing_user = await db.scalar(
+        select(models.User).where(models.User.email == user.email)
+    )
+    if existing_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+    hashed_password = await auth.get_password_hash_async(user.password)
+    new_user = models.User(email=user.email, hashed_password=hashed_password)
+    db.add(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    logger.info("User %s registered successfully", new_user.id)
+    return new_user
+
+
+@router.post("/token", response_model=schemas.Token)
+async def login_for_access_token(
+    db: AsyncSession = Depends(get_async_db),
+    form_data: OAuth2PasswordRequestForm = Depends(),
+):
+    """Login and get JWT token"""
+    logger.info("Login attempt for user: %s", form_data.username)
+    user = await auth.authenticate_user_async(
+        db, form_data.username, form_data.password
+    )
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+
+    access_token = auth.create_access_token(data={"sub": str(user.id)})
+    logger.info("User %s logged in successfully", user.id)
+    return {"access_token": access_token, "token_type": "bearer"}
@@ -1,11 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Literal, Optional, Union
+
+from fastapi import APIRouter, Depends, Header, HTTPException
 from sqlalchemy.orm import Session
 
-from app import auth, models, schemas
+from app import auth, crud, models, schemas
 from app.database import get_db
+from app.idempotency import run_idempotent
 from app.logger import logger
+from app.metrics import CHECKOUTS
+from app.order_processing import order_worker
+from app.pagination import decode_cursor, set_next_cursor
+from app.replication import get_read_db, record_write
+from app.serialization import RawJSONResponse, dump_rows
+from app.timing import TimedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.post("/orders/", response_model=schemas.OrderResponse)
@@ -13,71 +22,78 @@ def create_order(
     order: schemas.OrderCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
     """
     Create an order, ensuring the logged-in user is associated with it.
+
+    With an `Idempotency-Key` header the order is placed at most once per key
+    and user. Retries get the stored response, marked with
+    `Idempotent-Replayed: true`, and a retry arriving while the first attempt
+    is still running waits for it.
     """
-    logger.info(f"User {current_user.id} placing an order")
+    if idempotency_key is None:
+        return _place_order(order, db, current_user)
+    return run_idempotent(
+        db,
+        current_user.id,
+        idempotency_key,
+        order.model_dump(),
+        lambda before_commit: _place_order(order, db, current_user, before_commit),
+        schemas.OrderResponse,
+    )
+
+
+def _place_order(
+    order: schemas.OrderCreate,
+    db: Session,
+    current_user: models.User,
+    before_commit=None,
+):
+    logger.info("User %s placing an order", current_user.id)
     try:
-        total_price = 0.0
-        order_items = []
-
-        for item in order.products:
-            product = (
-                db.query(models.Product)
-                .filter(models.Product.id == item.product_id)
-                .first()
-            )
-            if not product or product.stock < item.quantity:
-                logger.warning(f"Not enough stock for product {item.product_id}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Not enough stock for product {item.product_id}",
-                )
-
-            total_price += product.price * item.quantity
-            order_items.append(
-                models.OrderItem(product_id=item.product_id, quantity=item.quantity)
-            )
-
-        db_order = models.Order(
-            user_id=current_user.id, total_price=total_price, status="pending"
+        db_order = crud.create_order(
+            db=db, order=order, user_id=current_user.id, before_commit=before_commit
         )
-        db.add(db_order)
-        db.commit()
-        db.refresh(db_order)
-
-        # Deduct stock
-        for item in order.products:
-            product = (
-                db.query(models.Product)
-                .filter(models.Product.id == item.product_id)
-                .first()
-            )
-            product.stock -= item.quantity
-            db.add(product)
-
-        # Save order items
-        for order_item in order_items:
-            order_item.order_id = db_order.id
-            db.add(order_item)
-
-        db.commit()
-        db.refresh(db_order)
-        logger.info(f"Order {db_order.id} created successfully")
-        return db_order
+    except HTTPException:
+        db.rollback()
+        raise
+    except crud.InsufficientStockError as e:
+        db.rollback()
+        CHECKOUTS.inc(result="insufficient_stock")
+        logger.warning("%s", e)
+        raise HTTPException(status_code=400, detail=e.lines)
+    except ValueError as e:
+        db.rollback()
+        CHECKOUTS.inc(result="invalid")
+        logger.warning("%s", e)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         db.rollback()
-        logger.error(f"Error creating order: {str(e)}")
+        CHECKOUTS.inc(result="error")
+        logger.error("Error creating order: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+    CHECKOUTS.inc(result="success")
+    # Replicas may lag behind, the user's next reads go to the primary
+    record_write(current_user.id)
+    # Payment, fulfillment and notification happen in the background
+    order_worker.enqueue(db_order.id)
+    logger.info("Order %s created successfully", db_order.id)
+    return db_order
+
 
-@router.get("/orders/", response_model=list[schemas.OrderResponse])
+@router.get(
+    "/orders/",
+    response_model=list[Union[schemas.OrderDetailResponse, schemas.OrderResponse]],
+)
 def get_orders(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user),
+    cursor: Optional[str] = None,
+    expand: Optional[Literal["items"]] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.get_current_principal),
 ):
     """
     Retrieve a list of orders for the logged-in user.
@@ -85,19 +101,56 @@ def get_orders(
     Args:
         skip (int): Number of orders to skip for pagination. Defaults to 0.
         limit (int): Maximum number of orders to return. Defaults to 100.
-        db (Session): Database session injected via the `get_db` dependency.
+        cursor (str, optional): `X-Next-Cursor` of the previous page. When
+            given, `skip` is ignored and the page is found by keyset seek.
+        expand (str, optional): `items` to include every order's line items
+            and product summaries, as in `GET /orders/{order_id}`.
+        db (Session): Database session injected via `get_read_db`, reading
+            from a replica if there are any.
         current_user (models.User): The currently authenticated user.
 
     Returns:
-        list[schemas.OrderResponse]: List of the user's orders.
+        list[schemas.OrderResponse]: List of the user's orders, as
+        `schemas.OrderDetailResponse` with `expand=items`. A full page
+        carries the cursor of the next page in the `X-Next-Cursor` header.
     """
-    logger.info(f"Fetching orders for user {current_user.id}")
-    orders = (
-        db.query(models.Order)
-        .filter(models.Order.user_id == current_user.id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+    schema = schemas.OrderDetailResponse if expand else schemas.OrderResponse
+    logger.info("Fetching orders for user %s", current_user.id)
+    orders = crud.get_orders(
+        db=db,
+        user_id=current_user.id,
+        skip=skip,
+        limit=limit,
+        after_id=decode_cursor(cursor),
+        with_items=expand is not None,
     )
-    logger.info(f"Retrieved {len(orders)} orders")
-    return orders
+    response = RawJSONResponse(dump_rows(schema, orders))
+    set_next_cursor(response, orders, limit)
+    logger.info("Retrieved %s orders", len(orders))
+    return response
+
+
+@router.get("/orders/{order_id}", response_model=schemas.OrderDetailResponse)
+def get_order(
+    order_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(auth.get_current_principal),
+):
+    """
+    Retrieve one of the logged-in user's orders with its line items.
+
+    Args:
+        order_id (int): Id of the order.
+        db (Session): Database session injected via `get_read_db`, reading
+            from a replica if there are any.
+        current_user (models.User): The currently authenticated user.
+
+    Returns:
+        schemas.OrderDetailResponse: The order with every line item and a
+        summary of its product. Orders of other users are reported as not
+        found.
+    """
+    order = crud.get_order(db=db, order_id=order_id, user_id=current_user.id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
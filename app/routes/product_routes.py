@@ -1,11 +1,30 @@
-from fastapi import APIRouter, Depends
+from decimal import Decimal
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app import auth, crud, models, schemas
+from app.bulk import FORMATS, detect_format, import_products
+from app.cache import product_cache
 from app.database import get_db
+from app.export import (
+    MEDIA_TYPES,
+    encode_header,
+    encode_rows,
+    export_headers,
+    export_statement,
+    parse_fields,
+)
 from app.logger import logger
+from app.pagination import decode_cursor, next_cursor_headers
+from app.replication import get_read_db
+from app.serialization import RawJSONResponse, dump_rows
+from app.timing import TimedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.post("/products/", response_model=schemas.Product)
@@ -27,7 +46,7 @@ def create_product(
     Returns:
         schemas.Product: The newly created product.
     """
-    logger.info(f"User {current_user.id} creating product: {product.name}")
+    logger.info("User %s creating product: %s", current_user.id, product.name)
     new_product = models.Product(
         name=product.name,
         description=product.description,
@@ -39,24 +58,169 @@ def create_product(
     db.add(new_product)
     db.commit()
     db.refresh(new_product)
-    logger.info(f"Product {new_product.id} created successfully")
+    product_cache.invalidate()
+    logger.info("Product %s created successfully", new_product.id)
     return new_product
 
 
+@router.post("/products/bulk", response_model=schemas.BulkImportReport)
+async def bulk_import_products(
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """
+    Import products from a streamed NDJSON or CSV body.
+
+    Args:
+        request (Request): Request whose body is read as a stream.
+        fmt (str, optional): `ndjson` or `csv`. Defaults to the format implied
+            by the `Content-Type` header, or `ndjson`.
+        db (Session): Database session injected via the `get_db` dependency.
+        current_user (models.User): The currently authenticated user.
+
+    Returns:
+        schemas.BulkImportReport: Inserted and failed row counts with the
+        errors of the first rejected rows.
+    """
+    fmt = fmt or detect_format(request.headers.get("content-type"))
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    logger.info("User %s importing products as %s", current_user.id, fmt)
+
+    async def insert_chunk(rows):
+        await run_in_threadpool(crud.bulk_create_products, db, rows, current_user.id)
+
+    report = await import_products(request.stream(), fmt, insert_chunk)
+    if report.inserted:
+        await run_in_threadpool(product_cache.invalidate)
+    logger.info("Imported %s products, rejected %s", report.inserted, report.failed)
+    return report.to_dict()
+
+
+@router.get("/products/export")
+def export_products(
+    fmt: str = Query("ndjson", alias="format"),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    """
+    Stream the whole catalog as NDJSON or CSV.
+
+    Args:
+        fmt (str): `ndjson` or `csv`. Defaults to `ndjson`.
+        fields (str, optional): Comma separated columns to export. Defaults
+            to all product fields.
+        db (Session): Database session injected via `get_read_db`, reading
+            from a replica if there are any.
+
+    Returns:
+        StreamingResponse: Rows written as they are read from a server-side
+        cursor, so memory use does not grow with the catalog.
+    """
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    columns = parse_fields(fields)
+    logger.info("Exporting products as %s", fmt)
+
+    def rows():
+        # The dependency has already closed the session, which stays usable
+        # and is closed again once the stream is exhausted
+        try:
+            yield encode_header(fmt, columns)
+            result = db.execute(export_statement(columns))
+            for partition in result.partitions():
+                yield encode_rows(fmt, columns, partition)
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        rows(), media_type=MEDIA_TYPES[fmt], headers=export_headers(fmt)
+    )
+
+
+@router.get("/products/search", response_model=list[schemas.Product])
+def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    min_price: Optional[Decimal] = Query(None, ge=0),
+    max_price: Optional[Decimal] = Query(None, ge=0),
+    in_stock: bool = False,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+):
+    """
+    Search products by name and description.
+
+    Args:
+        q (str): Search words. On PostgreSQL quoted phrases, `or` and
+            `-word` are understood as well.
+        min_price (Decimal, optional): Lowest price to include.
+        max_price (Decimal, optional): Highest price to include.
+        in_stock (bool): Only include products with stock left.
+        skip (int): Number of results to skip. Defaults to 0.
+        limit (int): Maximum number of results, at most 100. Defaults to 20.
+        db (Session): Database session injected via `get_read_db`, reading
+            from a replica if there are any.
+
+    Returns:
+        list[schemas.Product]: Matching products, most relevant first.
+    """
+    logger.info("Searching products for %r", q)
+    products = crud.search_products(
+        db=db,
+        q=q,
+        min_price=min_price,
+        max_price=max_price,
+        in_stock=in_stock,
+        skip=skip,
+        limit=limit,
+    )
+    logger.info("Found %s products", len(products))
+    return RawJSONResponse(dump_rows(schemas.Product, products))
+
+
 @router.get("/products/", response_model=list[schemas.Product])
-def get_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_products(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
     """
     Retrieve a list of products from the database.
 
     Args:
+        request (Request): Incoming request, read for conditional headers.
         skip (int): Number of products to skip for pagination. Defaults to 0.
         limit (int): Maximum number of products to return. Defaults to 100.
-        db (Session): Database session injected via the `get_db` dependency.
+        cursor (str, optional): `X-Next-Cursor` of the previous page. When
+            given, `skip` is ignored and the page is found by keyset seek.
+        db (Session): Database session injected via `get_read_db`, reading
+            from a replica if there are any.
 
     Returns:
-        list[schemas.Product]: List of products.
+        list[schemas.Product]: List of products. A full page carries the
+        cursor of the next page in the `X-Next-Cursor` header. Pages are
+        served from the catalog cache with `ETag`/`Last-Modified`, and a
+        matching conditional request gets an empty 304. The page body is
+        cached already encoded and sent as is.
     """
-    logger.info("Fetching products from database")
-    products = crud.get_products(db=db, skip=skip, limit=limit)
-    logger.info(f"Retrieved {len(products)} products")
-    return products
+    after_id = decode_cursor(cursor)
+    key = product_cache.page_key(skip=skip, limit=limit, after_id=after_id)
+    page = product_cache.get(key)
+    if page is None:
+        logger.info("Fetching products from database")
+        products = crud.get_products(db=db, skip=skip, limit=limit, after_id=after_id)
+        page = product_cache.store(key, products)
+
+    if page.not_modified(request):
+        return Response(status_code=304, headers=page.headers())
+    headers = {
+        **page.headers(),
+        **next_cursor_headers(page.count, page.last_id, limit),
+    }
+    logger.info("Retrieved %s products", page.count)
+    return RawJSONResponse(page.body, headers=headers)
@@ -1,43 +1,48 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app import auth, models, schemas
 from app.database import get_db
 from app.logger import logger
+from app.timing import TimedRoute
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+# These routes are async so that waiting on a password hash does not hold a
+# threadpool thread, only the queries go to the threadpool
 
 
 @router.post("/register/", response_model=schemas.UserResponse)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Register a new user"""
-    logger.info(f"Registering user with email: {user.email}")
-    existing_user = (
-        db.query(models.User).filter(models.User.email == user.email).first()
-    )
+    logger.info("Registering user with email: %s", user.email)
+    existing_user = await run_in_threadpool(auth.get_user_by_email, db, user.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await auth.get_password_hash_async(user.password)
     new_user = models.User(email=user.email, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    logger.info(f"User {new_user.id} registered successfully")
+    await run_in_threadpool(db.commit)
+    await run_in_threadpool(db.refresh, new_user)
+    logger.info("User %s registered successfully", new_user.id)
     return new_user
 
 
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()
 ):
     """Login and get JWT token"""
-    logger.info(f"Login attempt for user: {form_data.username}")
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
-    if not user:
+    logger.info("Login attempt for user: %s", form_data.username)
+    user = await run_in_threadpool(auth.get_user_by_email, db, form_data.username)
+    if not user or not await auth.verify_password_async(
+        form_data.password, user.hashed_password
+    ):
         raise HTTPException(status_code=400, detail="Incorrect username or password")
 
     access_token = auth.create_access_token(data={"sub": str(user.id)})
-    logger.info(f"User {user.id} logged in successfully")
+    logger.info("User %s logged in successfully", user.id)
     return {"access_token": access_token, "token_type": "bearer"}
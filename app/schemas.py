@@ -1,6 +1,15 @@
-from typing import List
+from decimal import Decimal
+from typing import Annotated, List
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, PlainSerializer
+
+# Amounts are exact decimals in Python and the database, JSON numbers on the
+# wire. Two decimal places, like the Numeric(12, 2) money columns
+Money = Annotated[
+    Decimal,
+    Field(max_digits=12, decimal_places=2),
+    PlainSerializer(float, return_type=float, when_used="json"),
+]
 
 
 class UserCreate(BaseModel):
@@ -12,8 +21,7 @@ class UserResponse(BaseModel):
     id: int
     email: EmailStr
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class Token(BaseModel):
@@ -31,13 +39,12 @@ class ProductBase(BaseModel):
         max_length=500,
         description="Product description (5-500 characters)",
     )
-    price: float = Field(
+    price: Money = Field(
         ..., gt=0, description="Product price must be greater than zero"
     )
     stock: int = Field(..., ge=0, description="Stock quantity cannot be negative")
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ProductCreate(ProductBase):
@@ -48,15 +55,26 @@ class ProductResponse(BaseModel):
     id: int
     name: str
     description: str = Field(..., min_length=5)  # Minimum length requirement
-    price: float
+    price: Money
     stock: int
 
 
 class Product(ProductBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BulkImportError(BaseModel):
+    line: int
+    errors: List[dict]
+
+
+class BulkImportReport(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkImportError]
+    errors_truncated: bool
 
 
 class OrderItemBase(BaseModel):
@@ -70,8 +88,29 @@ class OrderCreate(BaseModel):
 
 class OrderResponse(BaseModel):
     id: int
-    total_price: float
+    total_price: Money
     status: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ProductSummary(BaseModel):
+    id: int
+    name: str
+    price: Money
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class OrderItemResponse(BaseModel):
+    product_id: int
+    quantity: int
+    # Price the product had when the order was placed
+    unit_price: Money
+    product: ProductSummary
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class OrderDetailResponse(OrderResponse):
+    items: List[OrderItemResponse] = Field(validation_alias="order_items")
@@ -0,0 +1,28 @@
+from functools import lru_cache
+
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+
+class RawJSONResponse(Response):
+    """JSON response whose body is already encoded"""
+
+    media_type = "application/json"
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(schema: type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(list[schema])
+
+
+def dump_rows(schema: type[BaseModel], rows) -> bytes:
+    """
+    Encode ORM rows as a JSON array shaped by ``schema``.
+
+    Attributes are read and encoded by pydantic-core in one pass, skipping
+    the ``jsonable_encoder`` round trip through Python dicts that a
+    ``response_model`` goes through. Endpoints returning the bytes in a
+    ``RawJSONResponse`` keep ``response_model`` for the OpenAPI schema only.
+    """
+    adapter = _list_adapter(schema)
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
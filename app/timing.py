@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+
+class RepeatedStatementError(RuntimeError):
+    """Raised when a request repeats a statement more often than allowed."""
+
+
+class QueryStats:
+    """Statements executed within a scope, counted per SQL text"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements: dict[str, int] = {}
+
+    def record(self, statement: str) -> None:
+        self.count += 1
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        """
+        Statements run more than ``threshold`` times. The same SQL text run
+        over and over with different parameters is the signature of an N+1
+        query pattern.
+        """
+        return {sql: n for sql, n in self.statements.items() if n > threshold}
+
+
+class RequestTimings:
+    """Time spent per phase of one request, in nanoseconds"""
+
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.phases: dict[str, int] = {}
+        self.query_stats = QueryStats()
+        self.endpoint_done_ns: Optional[int] = None
+
+    @property
+    def queries(self) -> int:
+        return self.query_stats.count
+
+    def add(self, name: str, duration_ns: int) -> None:
+        self.phases[name] = self.phases.get(name, 0) + duration_ns
+
+    def finish_serialization(self) -> None:
+        """Record the time from the endpoint returning until the response starts"""
+        if self.endpoint_done_ns is not None and "serialize" not in self.phases:
+            self.add("serialize", time.perf_counter_ns() - self.endpoint_done_ns)
+
+    def elapsed_ns(self) -> int:
+        return time.perf_counter_ns() - self.start_ns
+
+    def as_ms(self) -> dict[str, float]:
+        return {name: ns / 1e6 for name, ns in self.phases.items()}
+
+    def server_timing(self) -> str:
+        """Render a ``Server-Timing`` header value, durations in milliseconds"""
+        metrics = [f"{name};dur={ms:.2f}" for name, ms in self.as_ms().items()]
+        metrics.append(f"total;dur={self.elapsed_ns() / 1e6:.2f}")
+        return ", ".join(metrics)
+
+
+# The timings object is shared, not copied, by threadpool workers and
+# greenlets serving the request, so phases recorded there are visible here
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def start_request_timings() -> tuple[RequestTimings, object]:
+    timings = RequestTimings()
+    return timings, _request_timings.set(timings)
+
+
+def end_request_timings(token) -> None:
+    _request_timings.reset(token)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _request_timings.get()
+
+
+@contextmanager
+def timed(name: str):
+    """Add the duration of the block to phase ``name`` of the current request"""
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(name, time.perf_counter_ns() - start)
+
+
+# Counters opened with count_queries, fed by statements from any thread
+_query_counters: list[QueryStats] = []
+_query_counters_lock = threading.Lock()
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the statements executed while the block runs, on any thread.
+
+    Meant for tests, to pin the number of statements an endpoint issues::
+
+        with count_queries() as stats:
+            client.get("/orders/")
+        assert stats.count <= 3
+    """
+    stats = QueryStats()
+    with _query_counters_lock:
+        _query_counters.append(stats)
+    try:
+        yield stats
+    finally:
+        with _query_counters_lock:
+            _query_counters.remove(stats)
+
+
+def install_db_timing(engine) -> None:
+    """
+    Accumulate time spent executing statements on ``engine`` as ``db`` and
+    count them per request and for ``count_queries``
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start_ns", []).append(time.perf_counter_ns())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        start = conn.info["query_start_ns"].pop()
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add("db", time.perf_counter_ns() - start)
+            timings.query_stats.record(statement)
+        if _query_counters:
+            with _query_counters_lock:
+                for stats in _query_counters:
+                    stats.record(statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        # A failed statement never reaches after_cursor_execute, its start
+        # time is dropped here so the stack stays balanced
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start_ns"):
+            start = conn.info["query_start_ns"].pop()
+            timings = _request_timings.get()
+            if timings is not None:
+                timings.add("db", time.perf_counter_ns() - start)
+
+
+def _mark_endpoint_done() -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.endpoint_done_ns = time.perf_counter_ns()
+
+
+class TimedRoute(APIRoute):
+    """
+    Route that notes when its endpoint returns, so the time FastAPI then
+    spends validating and encoding the response shows up as ``serialize``.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kw):
+                try:
+                    return await endpoint(*args, **kw)
+                finally:
+                    _mark_endpoint_done()
+
+        else:
+
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args, **kw):
+                try:
+                    return endpoint(*args, **kw)
+                finally:
+                    _mark_endpoint_done()
+
+        super().__init__(path, timed_endpoint, **kwargs)
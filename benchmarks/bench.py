@@ -0,0 +1,298 @@
+"""
+Load benchmark of the hot endpoints against a throwaway SQLite database.
+
+The app runs in-process behind an ASGI client, so no server or PostgreSQL is
+needed. Seeded data, request mix and random choices are fixed by the
+arguments, which makes reports of two commits comparable::
+
+    python -m benchmarks.bench --concurrency 16 --output before.json
+    git checkout other-branch
+    python -m benchmarks.bench --concurrency 16 --output after.json
+
+The report is JSON with the p50/p95/p99 latency in milliseconds, the
+throughput and the error count of every scenario, plus the parameters and
+commit it was produced with.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+SCENARIOS = ("token", "list_products", "create_order", "list_orders")
+PASSWORD = "benchmark-password"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--orders-per-user", type=int, default=20)
+    parser.add_argument(
+        "--requests", type=int, default=300, help="Measured requests per scenario"
+    )
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument(
+        "--scenarios", default=",".join(SCENARIOS), help="Comma separated subset"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--bcrypt-rounds",
+        type=int,
+        default=4,
+        help="Cost of password hashes, the default keeps /token from dominating",
+    )
+    parser.add_argument(
+        "--async-db", action="store_true", help="Serve through the async routers"
+    )
+    parser.add_argument(
+        "--database", help="New SQLite file to create, default a temporary one"
+    )
+    parser.add_argument("--output", help="Write the report here instead of stdout")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def configure(args: argparse.Namespace, database: str) -> None:
+    """Point the app at the benchmark database; must run before importing it"""
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{database}",
+        DATABASE_ASYNC=str(args.async_db).lower(),
+        BCRYPT_ROUNDS=str(args.bcrypt_rounds),
+        LOG_LEVEL="WARNING",
+        LOG_FILE="",
+        CACHE_BACKEND="memory",
+        METRICS_MULTIPROC_DIR="",
+    )
+
+
+def seed(args: argparse.Namespace, rng: random.Random) -> None:
+    """Fill the database with users, products and past orders"""
+    from sqlalchemy import insert, text
+
+    from app import auth, models
+    from app.database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        # Lets readers proceed while a checkout writes
+        conn.execute(text("PRAGMA journal_mode=WAL"))
+
+    hashed_password = auth.get_password_hash(PASSWORD)
+    with SessionLocal() as db:
+        db.execute(
+            insert(models.User),
+            [
+                {"email": f"user{i}@example.com", "hashed_password": hashed_password}
+                for i in range(args.users)
+            ],
+        )
+        db.execute(
+            insert(models.Product),
+            [
+                {
+                    "name": f"Product {i}",
+                    "description": f"Benchmark product number {i}",
+                    "price": round(rng.uniform(1, 500), 2),
+                    # Enough stock that checkouts never run out
+                    "stock": 10**9,
+                    "user_id": rng.randrange(args.users) + 1,
+                }
+                for i in range(args.products)
+            ],
+        )
+        db.execute(
+            insert(models.Order),
+            [
+                {
+                    "user_id": user_id,
+                    "total_price": round(rng.uniform(1, 500), 2),
+                    "status": "shipped",
+                }
+                for user_id in range(1, args.users + 1)
+                for _ in range(args.orders_per_user)
+            ],
+        )
+        db.commit()
+
+
+def percentile(quantiles: list[float], p: int) -> float:
+    return round(quantiles[p - 1], 3)
+
+
+def summarize(latencies_ms: list[float], errors: int, elapsed: float) -> dict:
+    quantiles = statistics.quantiles(latencies_ms, n=100, method="inclusive")
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "throughput_rps": round(len(latencies_ms) / elapsed, 2),
+        "latency_ms": {
+            "p50": percentile(quantiles, 50),
+            "p95": percentile(quantiles, 95),
+            "p99": percentile(quantiles, 99),
+            "mean": round(statistics.fmean(latencies_ms), 3),
+            "max": round(max(latencies_ms), 3),
+        },
+    }
+
+
+async def run_scenario(
+    send: Callable[[int], Awaitable[int]], requests: int, concurrency: int
+) -> dict:
+    """Issue ``requests`` calls of ``send`` with at most ``concurrency`` in flight"""
+    latencies_ms: list[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            status = await send(i)
+            latencies_ms.append((time.perf_counter() - start) * 1e3)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(latencies_ms, errors, time.perf_counter() - start)
+
+
+async def benchmark(args: argparse.Namespace, rng: random.Random) -> dict:
+    import httpx
+
+    from app.database import async_engine
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def login(i: int) -> httpx.Response:
+            return await client.post(
+                "/token",
+                data={
+                    "username": f"user{i % args.users}@example.com",
+                    "password": PASSWORD,
+                },
+            )
+
+        tokens = [(await login(i)).json()["access_token"] for i in range(args.users)]
+        # Random choices are drawn up front so every run sends the same requests
+        total = args.warmup + args.requests
+        users = [rng.randrange(args.users) for _ in range(total)]
+        pages = max(args.products // args.page_size, 1)
+        skips = [rng.randrange(pages) * args.page_size for _ in range(total)]
+        carts = [
+            [
+                {"product_id": product_id + 1, "quantity": rng.randint(1, 3)}
+                for product_id in rng.sample(range(args.products), rng.randint(1, 5))
+            ]
+            for _ in range(total)
+        ]
+
+        def auth_headers(i: int) -> dict:
+            return {"Authorization": f"Bearer {tokens[users[i]]}"}
+
+        async def token(i: int) -> int:
+            return (await login(users[i])).status_code
+
+        async def list_products(i: int) -> int:
+            params = {"skip": skips[i], "limit": args.page_size}
+            return (await client.get("/products/", params=params)).status_code
+
+        async def create_order(i: int) -> int:
+            response = await client.post(
+                "/orders/", json={"products": carts[i]}, headers=auth_headers(i)
+            )
+            return response.status_code
+
+        async def list_orders(i: int) -> int:
+            response = await client.get(
+                "/orders/", params={"limit": args.page_size}, headers=auth_headers(i)
+            )
+            return response.status_code
+
+        senders = {
+            "token": token,
+            "list_products": list_products,
+            "create_order": create_order,
+            "list_orders": list_orders,
+        }
+        results = {}
+        for name in args.scenarios.split(","):
+            send = senders[name]
+            if args.warmup:
+                await run_scenario(send, args.warmup, args.concurrency)
+
+            async def measured(i: int, send=send) -> int:
+                return await send(args.warmup + i)
+
+            results[name] = await run_scenario(
+                measured, args.requests, args.concurrency
+            )
+
+    if async_engine is not None:
+        # Pooled aiosqlite connections each hold a thread that blocks exit
+        await async_engine.dispose()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or os.path.join(tmp, "bench.db")
+        configure(args, database)
+        seed(args, rng)
+        results = asyncio.run(benchmark(args, rng))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "database": "sqlite",
+            "params": {
+                name: value
+                for name, value in vars(args).items()
+                if name not in ("output", "database")
+            },
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())